@@ -0,0 +1,400 @@
+# ニコリヒトのオフライン負荷テストニコリ！
+# Discord にも Gemini にもつながずに、偽物のゲートウェイ・チャンネル・Gemini・TTS を使って
+# on_message / reminder_loop / morning_message_loop / save_json を動かして測るニコリ。
+#
+#   python benchmarks/bench_bot.py --messages 500 --gemini-latency 0.3 --gemini-429 0.05
+#   python benchmarks/bench_bot.py --json after.json --compare before.json
+#
+# ボットの性能を変えるときは、変更前後でこれを回して比べてねニコリ。
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ---- 偽物たち ----
+class FakeUser:
+    def __init__(self, user_id, name="テストくん", bot=False, send_latency=0.0, sent=None):
+        self.id = user_id
+        self.display_name = name
+        self.name = name
+        self.bot = bot
+        self.send_latency = send_latency
+        self.sent = sent if sent is not None else []
+
+    def mentioned_in(self, message):
+        return any(user.id == self.id for user in message.mentions)
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.send_latency)
+        self.sent.append(content)
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, **kwargs):
+        await asyncio.sleep(self.channel.latency)
+
+
+class FakeChannel:
+    # 送ったメッセージの時刻を記録して、返事の遅延を測るチャンネルニコリ
+    def __init__(self, channel_id, latency=0.0):
+        self.id = channel_id
+        self.latency = latency
+        self.current_batch = None
+        self.sent = 0
+
+    def typing(self):
+        return FakeTyping()
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        batch, self.current_batch = self.current_batch, None
+        if batch is not None:
+            now = time.perf_counter()
+            for message in batch:
+                message.replied_at = now
+        return FakeSentMessage(self, content)
+
+
+class FakeMessage:
+    _ids = iter(range(10 ** 9))
+
+    def __init__(self, author, channel, content, mentions):
+        self.id = next(self._ids)
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.mentions = mentions
+        self.attachments = []
+        self.reference = None
+        self.guild = None
+        self.created = time.perf_counter()
+        self.replied_at = None
+
+    async def add_reaction(self, emoji):
+        self.replied_at = time.perf_counter()  # 断られたのも「返事」として数えるニコリ
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGeminiModel:
+    # 遅延と 429 の割合を決められる Gemini の代わりニコリ
+    def __init__(self, latency, rate_429, seed=0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def generate_content_async(self, contents):
+        self.calls += 1
+        await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.random.random() < self.rate_429:
+            self.rate_limited += 1
+            raise Exception("429 Resource has been exhausted (e.g. check quota). retry_delay { seconds: 1 }")
+        return StubResponse(f"テストの返事だニコリ！！（{self.calls}）")
+
+
+class SlowSilentBackend:
+    # 合成に時間がかかるふりをするダミーTTSニコリ（ワーカースレッドで動く）
+    def __init__(self, latency):
+        self.latency = latency
+
+    def synthesize(self, text, lang_code):
+        time.sleep(self.latency)
+        return f"[{lang_code}] {text}".encode("utf-8")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ---- ボットの読み込み ----
+def load_bot(args, workdir):
+    # 一時フォルダで動かして、本物のデータには触らないニコリ
+    os.chdir(workdir)
+    os.environ.setdefault("NIKORIHITO_QUEUE_COALESCE_WINDOW", str(args.coalesce))
+    os.environ.setdefault("NIKORIHITO_QUEUE_MAX_PENDING", str(args.max_pending))
+    os.environ.setdefault("NIKORIHITO_FLUSH_INTERVAL", "0.5")
+    os.environ.setdefault("NIKORIHITO_SLOW_STAGE_SECONDS", "3600")  # ベンチ中はログを静かにするニコリ
+    sys.path.insert(0, ROOT)
+
+    import nikorihitobot as nb
+    import nikorihito_tts
+
+    logging.getLogger("nikorihito.perf").setLevel(logging.WARNING)  # 1返事ごとのJSONログは止めるニコリ
+
+    stub = StubGeminiModel(args.gemini_latency, args.gemini_429, seed=args.seed)
+    nb._gemini_model = stub
+    nb.gemini_limiter.rate = nb.gemini_limiter.max_rate = args.gemini_rate
+    nb.gemini_limiter.burst = nb.gemini_limiter.tokens = max(1.0, args.gemini_rate)
+    nikorihito_tts._pipeline = nikorihito_tts.TTSPipeline(backend=SlowSilentBackend(args.tts_latency))
+
+    # 偽物のゲートウェイ：ボット自身と、キャッシュにいるユーザーニコリ
+    me = FakeUser(999, "nikorihito", bot=True)
+    nb.bot._connection.user = me
+    users = {}
+
+    def get_user(user_id):
+        user = users.get(user_id)
+        if user is None:
+            user = users[user_id] = FakeUser(user_id, send_latency=args.dm_latency)
+        return user
+
+    async def fetch_user(user_id):
+        return get_user(user_id)
+
+    async def process_commands(message):
+        return None
+
+    nb.bot.get_user = get_user
+    nb.bot.fetch_user = fetch_user
+    nb.bot.process_commands = process_commands
+    return nb, stub, me, users
+
+
+# ---- 各ベンチマーク ----
+async def bench_messages(nb, me, args):
+    # on_message にメンションを流して、スループットと返事の遅延を測るニコリ
+    channels = [FakeChannel(1000 + i, latency=args.send_latency) for i in range(args.channels)]
+    authors = [FakeUser(10_000 + i, f"ユーザー{i}") for i in range(args.users)]
+    original_handler = nb.mention_queue.handler
+
+    async def handler(channel_id, jobs):
+        jobs[-1]["message"].channel.current_batch = [job["message"] for job in jobs]
+        await original_handler(channel_id, jobs)
+
+    nb.mention_queue.handler = handler
+    rng = random.Random(args.seed)
+    messages = []
+    started = time.perf_counter()
+    for i in range(args.messages):
+        author = rng.choice(authors)
+        channel = rng.choice(channels)
+        message = FakeMessage(author, channel, f"<@{me.id}> ビーフシチューの話 {i} 番目ニコリ", [me])
+        messages.append(message)
+        await nb.on_message(message)
+        if args.arrival_rate > 0:
+            await asyncio.sleep(rng.expovariate(args.arrival_rate))
+
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(m.replied_at is not None for m in messages) and nb.mention_queue.pending == 0:
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    nb.mention_queue.handler = original_handler
+
+    latencies = [m.replied_at - m.created for m in messages if m.replied_at is not None]
+    queue = nb.mention_queue.snapshot()
+    return {
+        "messages": len(messages),
+        "answered": len(latencies),
+        "elapsed_sec": round(elapsed, 3),
+        "messages_per_sec": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_sec": round(percentile(latencies, 50), 4),
+        "latency_p99_sec": round(percentile(latencies, 99), 4),
+        "latency_mean_sec": round(statistics.fmean(latencies), 4) if latencies else 0.0,
+        "queue_shed": queue["shed"],
+        "queue_batches": queue["batches"],
+        "queue_max_depth": queue["max_depth"],
+        "cache": nb.response_cache.stats(),
+    }
+
+
+def bench_history_memory(nb, args):
+    # 長く話し続けたときに chat_history のメモリがどう増えるかを測るニコリ
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    checkpoints = {}
+    turn = 0
+    for target in args.history_checkpoints:
+        while turn < target:
+            uid = str(20_000 + turn % args.history_users)
+            if uid not in nb.chat_history:
+                nb.chat_history[uid] = nb.UserHistory(uid, "ながばなしくん")
+            nb.chat_history[uid].append("user", f"今日もマイクラで建築したよ {turn}")
+            nb.chat_history[uid].append("ニコリヒト😁", f"すごいニコリ！！ビーフシチュー食べるニコリ {turn}")
+            nb.save_json(nb.MEMORY_FILE, nb.chat_history, key=uid)
+            turn += 1
+        nb.get_store().flush()
+        checkpoints[str(target)] = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return {"users": args.history_users, "bytes_after_turns": checkpoints}
+
+
+def bench_save_json(nb, args):
+    # 1人分の保存（キーごと）と、昔の「ファイルまるごと書き直し」を比べるニコリ
+    store = nb.get_store()
+    data = {str(30_000 + i): {"name": f"u{i}", "history": [{"role": "user", "content": "あ" * 200}] * 6}
+            for i in range(args.save_users)}
+    store.save("bench_save.json", data)
+    store.flush()
+
+    started = time.perf_counter()
+    for i in range(args.save_rounds):
+        key = str(30_000 + i % args.save_users)
+        store.save("bench_save.json", data, key=key)
+        store.flush()
+    per_key = (time.perf_counter() - started) / args.save_rounds
+
+    started = time.perf_counter()
+    for _ in range(max(1, args.save_rounds // 10)):
+        with open("bench_legacy.json", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    legacy = (time.perf_counter() - started) / max(1, args.save_rounds // 10)
+    return {"users": args.save_users, "per_key_save_ms": round(per_key * 1000, 3),
+            "legacy_full_rewrite_ms": round(legacy * 1000, 3)}
+
+
+async def bench_reminders(nb, users, args):
+    # 同じ分に鳴るリマインダーをたくさん入れて、送り終わるまでの時間を測るニコリ
+    clock = [datetime(2026, 1, 1, 7, 29, 30)]
+    scheduler = nb.reminder_loop
+    scheduler.clock = lambda: clock[0]
+    for i in range(args.reminders):
+        uid = str(40_000 + i % args.users)
+        nb.reminders.add(uid, nb.Reminder(7, 30, f"水を飲む {i}", repeat=i % 2 == 0))
+    scheduler.rebuild()
+    clock[0] = datetime(2026, 1, 1, 7, 30, 0)
+    started = time.perf_counter()
+    await scheduler.fire_due()
+    elapsed = time.perf_counter() - started
+    delivered = sum(len(u.sent) for uid, u in users.items() if 40_000 <= uid < 50_000)
+    return {"reminders": args.reminders, "delivered": delivered, "elapsed_sec": round(elapsed, 3),
+            "still_scheduled": len(scheduler)}
+
+
+async def bench_broadcast(nb, users, args):
+    # 朝6:00のあいさつを N 人に送る時間を測るニコリ
+    class SixOClock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2026, 1, 1, 6, 0, 0)
+
+    for i in range(args.broadcast_users):
+        nb.user_settings.update(str(50_000 + i), morning_message=i % 10 != 0)
+    real_datetime = nb.datetime
+    nb.datetime = SixOClock
+    try:
+        started = time.perf_counter()
+        await nb.morning_message_loop.coro()
+        elapsed = time.perf_counter() - started
+    finally:
+        nb.datetime = real_datetime
+    record = nb.morning_log.get("2026-01-01", {})
+    return {"users": args.broadcast_users, "sent": len(record.get("sent", [])),
+            "failed": len(record.get("failed", [])), "elapsed_sec": round(elapsed, 3)}
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="nikorihito-bench-")
+    nb, stub, me, users = load_bot(args, workdir)
+    results = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")}}
+    results["on_message"] = await bench_messages(nb, me, args)
+    results["on_message"]["gemini_calls"] = stub.calls
+    results["on_message"]["gemini_429"] = stub.rate_limited
+    results["history_memory"] = bench_history_memory(nb, args)
+    results["save_json"] = bench_save_json(nb, args)
+    results["reminder_loop"] = await bench_reminders(nb, users, args)
+    results["morning_broadcast"] = await bench_broadcast(nb, users, args)
+    nb.get_store().flush()
+    results["workdir"] = workdir
+    return results
+
+
+def flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            flatten(f"{prefix}.{key}" if prefix else key, child, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def print_report(results, baseline=None):
+    current = flatten("", {k: v for k, v in results.items() if k != "config"}, {})
+    before = flatten("", {k: v for k, v in baseline.items() if k != "config"}, {}) if baseline else {}
+    width = max(len(k) for k in current)
+    for key, value in current.items():
+        line = f"{key:<{width}}  {value:>12}"
+        if key in before:
+            old = before[key]
+            change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            line += f"  (before {old}, {change})"
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ニコリヒトのオフライン負荷テストニコリ")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--arrival-rate", type=float, default=0.0, help="1秒あたりの平均メンション数（0 なら一気に流す）")
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--gemini-429", type=float, default=0.02, help="429 を返す割合")
+    parser.add_argument("--gemini-rate", type=float, default=50.0, help="リミッターの初期レート（1秒あたり）")
+    parser.add_argument("--tts-latency", type=float, default=0.05)
+    parser.add_argument("--send-latency", type=float, default=0.02)
+    parser.add_argument("--dm-latency", type=float, default=0.02)
+    parser.add_argument("--coalesce", type=float, default=0.0)
+    parser.add_argument("--max-pending", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--history-users", type=int, default=20)
+    parser.add_argument("--history-checkpoints", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--save-users", type=int, default=2000)
+    parser.add_argument("--save-rounds", type=int, default=200)
+    parser.add_argument("--reminders", type=int, default=2000)
+    parser.add_argument("--broadcast-users", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--compare", help="前に保存した結果と比べるニコリ")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(os.path.abspath(args.compare), encoding="utf-8") as f:
+            baseline = json.load(f)
+    json_path = os.path.abspath(args.json) if args.json else None
+    results = asyncio.run(run(args))
+    print_report(results, baseline)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# プロンプト組み立てのベンチマークニコリ！
+# 昔の ask_nikorihito と同じやり方（毎回f-stringで全部作り直す）と PromptBuilder を比べるニコリ。
+#   python benchmarks/bench_prompt.py [回数]
+# 時間は何回か測っていちばん速かった回ニコリ（ほかの処理に邪魔された回を混ぜない）。
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nikorihito_history import HistoryEntry  # noqa: E402
+from nikorihito_prompt import PERSONA_JA, estimate_tokens, get_prompt_builder  # noqa: E402
+
+
+def legacy_build(user_name, user_input, history, attachment_lines):
+    # 変更前のコードと同じ組み立て方ニコリ（キャラ設定ごと毎回フォーマット）
+    if attachment_lines:
+        user_input += "\n[添付ファイルが送られたニコリ！内容はこちらニコリ：\n" + "\n".join(attachment_lines) + "\n]"
+    history_text = "\n".join([f"{entry.role}：{entry.content}" for entry in history[-6:]])
+    file_prompt = ""
+    if "[添付ファイルが送られたニコリ！" in user_input:
+        file_prompt = "ユーザーが添付した画像やGIFなどのファイルの中身にも注目して、それについてコメントしてねニコリ！見たままを元に、正確に返事してねニコリ！"
+    persona = PERSONA_JA.strip("\n")
+    return f"""
+{persona}
+
+{file_prompt}
+
+最近の会話：
+{history_text}
+
+{user_name}がこう言ったニコリ：
+{user_input}
+
+元気いっぱいに返事するニコリ！
+"""
+
+
+def new_build(user_name, user_input, history, attachment_lines):
+    # ボットでは UserHistory が行を作り置きしてるので、ここでは作った行をそのまま渡すニコリ
+    # （履歴は全部渡して、予算で切るのは PromptBuilder に任せる）
+    return get_prompt_builder("日本語").build(user_name, user_input, history.lines, attachment_lines)
+
+
+SCENARIOS = {
+    "short": ("おはようニコリヒト！", 6, 0),
+    "long_input": ("ビーフシチューの作り方を教えて！" * 200, 6, 0),
+    "many_attachments": ("これ見て！", 6, 30),
+    "long_history": ("昨日の話の続きだよ", 200, 0),
+}
+
+
+class HistoryList(list):
+    lines = ()
+
+
+def make_case(text, history_len, attachments):
+    content = "マイクラで建築したよ！" * (40 if history_len else 1)
+    history = HistoryList(HistoryEntry("user" if i % 2 == 0 else "ニコリヒト😁", content) for i in range(history_len))
+    history.lines = [e.line() for e in history]
+    attachment_lines = [
+        f"https://cdn.discordapp.com/attachments/1/{i}/image_{i}.png （画像ファイルっぽいニコリ！）"
+        for i in range(attachments)
+    ]
+    return ("たろう", text, history, attachment_lines)
+
+
+def best_us(func, number, repeat=5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(number=2000):
+    print(f"{'scenario':<18}{'legacy us':>11}{'new us':>9}{'legacy tok':>12}{'new tok':>9}")
+    for name, spec in SCENARIOS.items():
+        case = make_case(*spec)
+        legacy_us = best_us(lambda: legacy_build(*case), number)
+        new_us = best_us(lambda: new_build(*case), number)
+        legacy_tok = estimate_tokens(legacy_build(*case))
+        new_tok = estimate_tokens(new_build(*case))
+        print(f"{name:<18}{legacy_us:>11.1f}{new_us:>9.1f}{legacy_tok:>12}{new_tok:>9}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,119 @@
+# 添付ファイルを Gemini にちゃんと見せるところニコリ！
+# URLを文章に貼るだけじゃなくて、画像はダウンロードして（大きさの上限つき）
+# 大きすぎるものはワーカースレッドで縮めてから、そのまま Gemini に渡すニコリ。
+# 取ってきた中身は添付ファイルのIDで覚えておくので、同じ画像への返信や再メンションでは
+# ダウンロードも縮小もやり直さないニコリ！
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp  # type: ignore
+
+from nikorihito_lru import SizedLRU
+
+ATTACHMENT_MAX_BYTES = int(os.getenv("NIKORIHITO_ATTACHMENT_MAX_BYTES", str(8 * 1024 * 1024)))  # ダウンロードの上限
+ATTACHMENT_INLINE_BYTES = int(os.getenv("NIKORIHITO_ATTACHMENT_INLINE_BYTES", str(4 * 1024 * 1024)))  # Geminiに渡す上限
+ATTACHMENT_MAX_SIDE = int(os.getenv("NIKORIHITO_ATTACHMENT_MAX_SIDE", "1024"))  # 長い辺をこれ以下に縮めるニコリ
+ATTACHMENT_MAX_PARTS = int(os.getenv("NIKORIHITO_ATTACHMENT_MAX_PARTS", "4"))
+ATTACHMENT_CACHE_BYTES = int(os.getenv("NIKORIHITO_ATTACHMENT_CACHE_BYTES", str(64 * 1024 * 1024)))
+ATTACHMENT_WORKERS = int(os.getenv("NIKORIHITO_ATTACHMENT_WORKERS", "2"))
+
+IMAGE_TYPES = {"image/png", "image/jpeg", "image/webp", "image/gif", "image/heic", "image/heif"}
+INLINE_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"}  # Gemini がそのまま読める形式
+
+
+def guess_content_type(attachment):
+    if attachment.content_type:
+        return attachment.content_type.split(";")[0].strip().lower()
+    name = attachment.filename.lower()
+    for ext, mime in ((".png", "image/png"), (".jpg", "image/jpeg"), (".jpeg", "image/jpeg"),
+                      (".webp", "image/webp"), (".gif", "image/gif")):
+        if name.endswith(ext):
+            return mime
+    return "application/octet-stream"
+
+
+def shrink_image(data, mime_type, max_side=ATTACHMENT_MAX_SIDE):
+    # ワーカースレッドで動かすニコリ：大きい画像は縮めて、GIFは1コマ目を静止画にするニコリ
+    try:
+        from PIL import Image  # type: ignore
+    except ImportError:  # Pillow がなければ縮めずにそのまま送るニコリ
+        return data, mime_type
+    with Image.open(io.BytesIO(data)) as img:
+        if max(img.size) <= max_side and mime_type in INLINE_TYPES and len(data) <= ATTACHMENT_INLINE_BYTES:
+            return data, mime_type
+        img.seek(0)
+        img.thumbnail((max_side, max_side))
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA", "P"):
+            img.save(out, format="PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        img.convert("RGB").save(out, format="JPEG", quality=85)
+        return out.getvalue(), "image/jpeg"
+
+
+class AttachmentFetcher:
+    def __init__(self, max_bytes=ATTACHMENT_MAX_BYTES, cache=None, workers=ATTACHMENT_WORKERS):
+        self.max_bytes = max_bytes
+        self.cache = cache or SizedLRU(
+            ATTACHMENT_CACHE_BYTES, sizeof=lambda part: len(part["data"]) if part else 0
+        )
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nikorihito-img")
+        self._session = None
+        self._inflight = {}
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self._session
+
+    async def download(self, url):
+        # 少しずつ読んで、上限を超えたらそこでやめるニコリ
+        chunks = []
+        total = 0
+        async with self._get_session().get(url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                total += len(chunk)
+                if total > self.max_bytes:
+                    raise ValueError(f"添付ファイルが大きすぎるニコリ（{self.max_bytes}バイトまで）")
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def fetch(self, attachment):
+        # Gemini に渡せる {"mime_type", "data"} を返すニコリ。渡せないものは None
+        mime_type = guess_content_type(attachment)
+        if mime_type not in IMAGE_TYPES or (attachment.size or 0) > self.max_bytes:
+            return None
+        key = attachment.id
+        part = self.cache.get(key)
+        if part is not None:
+            return part
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._load(attachment, mime_type))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, attachment, mime_type):
+        try:
+            data = await self.download(attachment.url)
+            loop = asyncio.get_running_loop()
+            data, mime_type = await loop.run_in_executor(self._executor, shrink_image, data, mime_type)
+        except Exception as e:
+            print(f"添付ファイル {attachment.filename} を読めなかったニコリ…", e)
+            return None
+        if mime_type not in INLINE_TYPES or len(data) > ATTACHMENT_INLINE_BYTES:
+            return None
+        part = {"mime_type": mime_type, "data": data}
+        self.cache.put(attachment.id, part)
+        return part
+
+    async def fetch_many(self, attachments):
+        parts = await asyncio.gather(*(self.fetch(a) for a in attachments[:ATTACHMENT_MAX_PARTS]))
+        return [part for part in parts if part]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
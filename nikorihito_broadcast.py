@@ -0,0 +1,91 @@
+# みんなにいっせいにDMを送るところニコリ！（朝6:00のあいさつなど）
+# ユーザーはまずゲートウェイのキャッシュから探して、いなければRESTで取りに行くニコリ。
+# 送信は決まった人数ずつ同時に送って、どこまで送ったかを記録しておくニコリ。
+# さらに一人ずつ、送る直前にDBへ「この人に送る」札をすぐ書き込む（claim）ので、
+# 途中で落ちて再起動しても同じ人に二回送らないニコリ！（落ちた瞬間に送りかけてた人は、届かないことがある）
+import asyncio
+import os
+import time
+
+BROADCAST_BATCH_SIZE = int(os.getenv("NIKORIHITO_BROADCAST_BATCH", "50"))  # 記録を保存する単位
+BROADCAST_CONCURRENCY = int(os.getenv("NIKORIHITO_BROADCAST_CONCURRENCY", "5"))  # 同時に送るDMの数
+BROADCAST_MAX_RETRIES = 3
+
+
+def _retry_after(error):
+    # 429 のときは Retry-After ヘッダー（なければ retry_after）の秒数だけ待つニコリ
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") or getattr(error, "retry_after", None)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class Broadcaster:
+    def __init__(self, bot, progress, save_progress,
+                 batch_size=BROADCAST_BATCH_SIZE, concurrency=BROADCAST_CONCURRENCY, claim=None):
+        self.bot = bot
+        self.progress = progress  # broadcast_id -> {"sent": [...], "done": bool, ...}
+        self.save_progress = save_progress  # save_progress(broadcast_id)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # async claim(broadcast_id, user_id) が False なら送らない（前に送りかけた人や、ほかのプロセスが送った人）
+        self.claim = claim
+
+    def is_done(self, broadcast_id):
+        return self.progress.get(broadcast_id, {}).get("done", False)
+
+    def has_started(self, broadcast_id):
+        return broadcast_id in self.progress
+
+    async def resolve_user(self, user_id):
+        return self.bot.get_user(int(user_id)) or await self.bot.fetch_user(int(user_id))
+
+    async def _send_one(self, semaphore, broadcast_id, user_id, text):
+        async with semaphore:
+            if self.claim is not None and not await self.claim(broadcast_id, user_id):
+                return None
+            for _ in range(BROADCAST_MAX_RETRIES):
+                try:
+                    user = await self.resolve_user(user_id)
+                    await user.send(text)
+                    return True
+                except Exception as e:
+                    if getattr(e, "status", None) == 429:
+                        await asyncio.sleep(_retry_after(e))
+                        continue
+                    print(f"{user_id} にDM送れなかったニコリ…", e)
+                    return False
+            print(f"{user_id} は混みすぎてて送れなかったニコリ…")
+            return False
+
+    async def run(self, broadcast_id, user_ids, text):
+        record = self.progress.setdefault(broadcast_id, {"sent": [], "failed": [], "done": False})
+        record.setdefault("started", time.time())
+        record.setdefault("skipped", [])
+        already = set(record["sent"]) | set(record["failed"]) | set(record["skipped"])
+        pending = [uid for uid in user_ids if uid not in already]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            results = await asyncio.gather(*(self._send_one(semaphore, broadcast_id, uid, text) for uid in batch))
+            for uid, ok in zip(batch, results):
+                if ok is None:
+                    record["skipped"].append(uid)  # 札が取れなかった人ニコリ
+                else:
+                    (record["sent"] if ok else record["failed"]).append(uid)
+            self.save_progress(broadcast_id)  # 送ったところまで記録するニコリ
+
+        record["done"] = True
+        record["seconds"] = record.get("seconds", 0.0) + (time.perf_counter() - started)
+        self.save_progress(broadcast_id)
+        print(
+            f"📣 一斉送信 {broadcast_id} 終わったニコリ！ "
+            f"送信={len(record['sent'])} 失敗={len(record['failed'])} 飛ばし={len(record['skipped'])} "
+            f"今回={len(pending)}人 時間={record['seconds']:.2f}s"
+        )
+        return record
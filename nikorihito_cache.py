@@ -0,0 +1,119 @@
+# よくある質問の返事を覚えておくキャッシュニコリ！
+# 「おはよう」「ビーフシチュー好き？」みたいな似たメンションに毎回 Gemini を呼ばないように、
+# 正規化した文章＋言語をキーにして返事を使い回すニコリ。文字n-gramでゆるく一致も探せるニコリ。
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+CACHE_MAX_ENTRIES = int(os.getenv("NIKORIHITO_CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL = float(os.getenv("NIKORIHITO_CACHE_TTL", "3600"))  # 秒
+CACHE_FUZZY_THRESHOLD = float(os.getenv("NIKORIHITO_CACHE_FUZZY", "0.8"))  # 0 でゆるい一致なし
+CACHE_MAX_INPUT_CHARS = int(os.getenv("NIKORIHITO_CACHE_MAX_INPUT_CHARS", "40"))  # 長い文章は覚えないニコリ
+CACHE_CONTEXT_SECONDS = float(os.getenv("NIKORIHITO_CACHE_CONTEXT_SECONDS", "180"))  # 会話の途中ならキャッシュを使わない
+CACHE_NGRAM = 2
+
+_REPEATS = re.compile(r"(.)\1{2,}")
+
+
+def normalize(text):
+    # 全角半角・大文字小文字・記号・空白・長音の連打をならすニコリ
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] in "LN")
+    return _REPEATS.sub(r"\1\1", text)
+
+
+def ngrams(text, n=CACHE_NGRAM):
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                 fuzzy_threshold=CACHE_FUZZY_THRESHOLD, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold
+        self.clock = clock
+        self._items = OrderedDict()  # (言語, 正規化した文章) -> (返事, 期限)
+        self._index = defaultdict(set)  # (言語, n-gram) -> キーのset
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.personal = 0  # 相手の名前が入ってたので覚えなかった返事の数
+
+    def cacheable(self, text):
+        return 0 < len(normalize(text)) <= CACHE_MAX_INPUT_CHARS
+
+    def get(self, text, language):
+        key = (language, normalize(text))
+        entry = self._items.get(key)
+        if entry is not None and entry[1] > self.clock():
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            self._remove(key)
+        if self.fuzzy_threshold > 0:
+            reply = self._fuzzy_get(key)
+            if reply is not None:
+                self.fuzzy_hits += 1
+                return reply
+        self.misses += 1
+        return None
+
+    def _fuzzy_get(self, key):
+        language, norm = key
+        grams = ngrams(norm)
+        counts = defaultdict(int)
+        for gram in grams:
+            for candidate in self._index.get((language, gram), ()):
+                counts[candidate] += 1
+        best, best_score = None, self.fuzzy_threshold
+        now = self.clock()
+        for candidate, shared in counts.items():
+            score = shared / len(grams | ngrams(candidate[1]))  # ジャッカード係数ニコリ
+            if score >= best_score and self._items[candidate][1] > now:
+                best, best_score = candidate, score
+        if best is None:
+            return None
+        self._items.move_to_end(best)
+        return self._items[best][0]
+
+    def put(self, text, language, reply, user_name=None):
+        # 相手の名前が入った返事は覚えないニコリ（ほかの人に出すと変になるので）
+        if user_name and user_name in reply:
+            self.personal += 1
+            return
+        key = (language, normalize(text))
+        if key in self._items:
+            self._remove(key)
+        self._items[key] = (reply, self.clock() + self.ttl)
+        for gram in ngrams(key[1]):
+            self._index[(language, gram)].add(key)
+        while len(self._items) > self.max_entries:
+            self._remove(next(iter(self._items)))
+
+    def _remove(self, key):
+        del self._items[key]
+        for gram in ngrams(key[1]):
+            keys = self._index.get((key[0], gram))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(key[0], gram)]
+
+    def stats(self):
+        lookups = self.hits + self.fuzzy_hits + self.misses
+        return {
+            "entries": len(self._items),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "personal": self.personal,
+            "hit_rate": round((self.hits + self.fuzzy_hits) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,205 @@
+# ニコリヒトをたくさんのサーバーで動かすためのシャード＆マルチプロセスまわりニコリ！
+#
+#   NIKORIHITO_SHARDING=auto python nikorihitobot.py       # 1プロセスで AutoShardedBot
+#   python nikorihito_cluster.py --workers 4 --shards 16   # 4プロセスに16シャードを分けて動かす
+#
+# 状態は全員で同じSQLite（nikorihito.db）に書いて、ほかのプロセスの変更は少しずつ取り込むニコリ。
+# リマインダーと朝のあいさつは「リーダー」のリースを持ってるプロセスだけが動かして、
+# さらに1回ごとに一回きりの札を取ってから送るので、リーダーが入れ替わっても二回送らないニコリ！
+# DBに書くこと（リースと札）はストアの書き込み用スレッドでやるので、ほかのプロセスが書いてて
+# 待たされても、ゲートウェイのハートビートは止まらないニコリ。
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+SHARDING = os.getenv("NIKORIHITO_SHARDING", "off")  # off / auto
+SHARD_COUNT = int(os.getenv("NIKORIHITO_SHARD_COUNT", "0")) or None  # 空なら Discord のおすすめの数
+SHARD_IDS = [int(x) for x in os.getenv("NIKORIHITO_SHARD_IDS", "").split(",") if x.strip()] or None
+WORKERS = int(os.getenv("NIKORIHITO_WORKERS", "1"))
+WORKER_INDEX = int(os.getenv("NIKORIHITO_WORKER_INDEX", "0"))
+SYNC_INTERVAL = float(os.getenv("NIKORIHITO_SYNC_INTERVAL", "2"))  # ほかのプロセスの変更を取り込む間隔（秒）
+LEASE_TTL = float(os.getenv("NIKORIHITO_LEASE_TTL", "15"))  # リーダーが黙ってから交代するまでの秒数
+CHANGE_LOG_KEEP = float(os.getenv("NIKORIHITO_CHANGE_LOG_KEEP", str(2 * 24 * 3600)))
+LEADER_LEASE = "leader"
+
+SHARDED = SHARDING == "auto" or SHARD_IDS is not None
+SHARED = WORKERS > 1
+
+
+def bot_options():
+    # commands.AutoShardedBot に渡すシャードの設定ニコリ
+    if not SHARDED:
+        return {}
+    return {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS}
+
+
+def owns_shard(shard_id):
+    return SHARD_IDS is None or shard_id in SHARD_IDS
+
+
+def shards_for_worker(worker_index, workers, shard_count):
+    # シャードを順番に配るニコリ（0,4,8.. / 1,5,9.. みたいに）
+    return list(range(worker_index, shard_count, workers))
+
+
+class Coordinator:
+    # ほかのプロセスの変更の取り込みと、リーダー選びを一つのループでやるニコリ
+    def __init__(self, get_store, shared=SHARED, interval=SYNC_INTERVAL, lease_ttl=LEASE_TTL):
+        self._get_store = get_store  # DBは使うときに開くニコリ（起動を遅くしないため）
+        self.shared = shared
+        self.interval = interval
+        self.lease_ttl = lease_ttl
+        self.is_leader = not shared  # 1プロセスならいつでもリーダーニコリ
+        self.on_elected = []  # リーダーになったときに呼ぶ関数
+        self.on_demoted = []  # リーダーじゃなくなったときに呼ぶ関数
+        self._states = {}  # path -> (LazyState, decode, 変わったキーを受け取る関数)
+        self._rev = 0
+        self._last_prune = 0.0
+        self._task = None
+
+    @property
+    def store(self):
+        return self._get_store()
+
+    def register(self, path, state, decode=None, on_change=None):
+        # decode(key, value) でDBの値を中身のオブジェクトにするニコリ
+        self._states[path] = (state, decode, on_change)
+
+    def start(self):
+        if not self.shared:
+            for callback in self.on_elected:
+                callback()
+            return None
+        if self._task is None or self._task.done():
+            self._rev = self.store.latest_rev()
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self):
+        while True:
+            try:
+                await self.elect()
+                self.pull()  # 読むだけ（WALなので書いてる人がいても待たない）ニコリ
+            except Exception as e:
+                print("ほかのプロセスとの同期で失敗したニコリ…", e)
+            await asyncio.sleep(self.interval)
+
+    async def elect(self):
+        store = self.store
+        held = await store.run_in_writer(store.claim, LEADER_LEASE, self.lease_ttl)
+        if held and not self.is_leader:
+            print(f"👑 ワーカー {WORKER_INDEX} がリーダーになったニコリ！")
+            self.is_leader = True
+            for callback in self.on_elected:
+                callback()
+        elif not held and self.is_leader:
+            print(f"ワーカー {WORKER_INDEX} はリーダーじゃなくなったニコリ…")
+            self.is_leader = False
+            for callback in self.on_demoted:
+                callback()
+        if self.is_leader and time.time() - self._last_prune > 3600:
+            self._last_prune = time.time()
+            await store.run_in_writer(store.prune, CHANGE_LOG_KEEP)
+
+    def pull(self):
+        self._rev, changed = self.store.changes_since(self._rev)
+        for path, keys in changed.items():
+            entry = self._states.get(path)
+            if entry is None:
+                continue
+            state, decode, on_change = entry
+            if not state.loaded:
+                continue  # まだ読んでないなら、読むときに最新になるニコリ
+            if "*" in keys:
+                state.reload()
+            else:
+                for key in keys:
+                    if self.store.is_dirty(path, key):
+                        continue  # こっちで書きかけの変更を優先するニコリ
+                    found, value = self.store.load_key(path, key)
+                    if found:
+                        state[key] = decode(key, value) if decode else value
+                    else:
+                        state.pop(key, None)
+            if on_change is not None:
+                on_change(keys)
+
+    async def claim_once(self, names):
+        if not self.shared:
+            return list(names)
+        store = self.store
+        return await store.run_in_writer(store.claim_once, names)
+
+    def release(self):
+        if self.shared and self.is_leader:
+            self.store.release(LEADER_LEASE)  # すぐ次のリーダーに渡すニコリ
+
+
+# ---- ランチャー ----
+def worker_env(worker_index, workers, shard_count, base_port):
+    env = dict(os.environ)
+    env.update({
+        "NIKORIHITO_WORKERS": str(workers),
+        "NIKORIHITO_WORKER_INDEX": str(worker_index),
+        "NIKORIHITO_SHARDING": "auto",
+        "NIKORIHITO_SHARD_COUNT": str(shard_count),
+        "NIKORIHITO_SHARD_IDS": ",".join(str(s) for s in shards_for_worker(worker_index, workers, shard_count)),
+        "PORT": str(base_port + worker_index),  # ヘルスチェックは1プロセス1ポートニコリ
+    })
+    return env
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ニコリヒトを何個かのプロセスで動かすニコリ")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("NIKORIHITO_WORKERS", "2")))
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT, help="全体のシャード数（省略時はワーカー数）")
+    parser.add_argument("--stagger", type=float, default=5.0, help="ワーカーを起こす間隔（秒）。IDENTIFY の制限よけニコリ")
+    args = parser.parse_args(argv)
+    shard_count = args.shards or args.workers
+    if shard_count < args.workers:
+        parser.error("シャード数はワーカー数以上にしてほしいニコリ")
+    base_port = int(os.environ.get("PORT", 10000))
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nikorihitobot.py")
+
+    stopping = False
+    children = {}
+
+    def spawn(index):
+        children[index] = subprocess.Popen(
+            [sys.executable, script], env=worker_env(index, args.workers, shard_count, base_port)
+        )
+        print(f"🚀 ワーカー {index} を起こしたニコリ（pid={children[index].pid}）")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children.values():
+            if child.poll() is None:
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        if stopping:
+            break
+        spawn(index)
+        time.sleep(args.stagger)
+    # 落ちたワーカーは少し待ってから起こし直すニコリ
+    while not stopping:
+        for index, child in list(children.items()):
+            if child.poll() is not None and not stopping:
+                print(f"ワーカー {index} が止まったので起こし直すニコリ（code={child.returncode}）")
+                time.sleep(args.stagger)
+                spawn(index)
+        time.sleep(1)
+    for child in children.values():
+        child.wait()
+
+
+if __name__ == "__main__":
+    main()
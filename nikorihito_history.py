@@ -0,0 +1,166 @@
+# 会話履歴をユーザーごとに一定数だけ持っておくニコリ！
+# プロンプトに使うのは直近の数件だけなので、古い発言はアーカイブ（JSONL）に追い出して
+# メモリも保存コストもずっと一定にするニコリ。
+# アーカイブへの書き込みは少しためてから、ストアの書き込み用スレッドでまとめて追記するニコリ
+# （メンションのたびにループの上でファイルを開かない）。
+import asyncio
+import atexit
+import json
+import os
+import sys
+import time
+from collections import deque
+
+HISTORY_WINDOW = int(os.getenv("NIKORIHITO_HISTORY_WINDOW", "6"))  # プロンプトに入れる件数
+ARCHIVE_FILE = os.getenv("NIKORIHITO_HISTORY_ARCHIVE", "nikorihito_history_archive.jsonl")
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("NIKORIHITO_FLUSH_INTERVAL", "2"))  # ストアのまとめ書きと同じ間隔
+
+_archive_pending = []  # まだファイルに書いてない行
+_archive_handle = None
+_archive_tasks = set()  # 書いてる途中のタスク（消えないように持っておくニコリ）
+
+
+class HistoryEntry:
+    __slots__ = ("role", "content", "_line")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+        self._line = None
+
+    def line(self):
+        # プロンプト用の1行は一回作ったら使い回すニコリ
+        if self._line is None:
+            self._line = f"{self.role}：{self.content}"
+        return self._line
+
+    def to_json(self):
+        return {"role": self.role, "content": self.content}
+
+
+class UserHistory:
+    __slots__ = ("user_id", "name", "history", "last_active")
+
+    def __init__(self, user_id, name="", entries=(), maxlen=HISTORY_WINDOW):
+        self.user_id = str(user_id)
+        self.name = name
+        self.history = deque(maxlen=maxlen)
+        self.last_active = 0.0  # 最後に話した時刻（保存はしないニコリ）
+        self.extend(entries)
+
+    @classmethod
+    def from_json(cls, user_id, data, maxlen=HISTORY_WINDOW):
+        entries = [HistoryEntry(e["role"], e["content"]) for e in data.get("history", [])]
+        return cls(user_id, data.get("name", ""), entries, maxlen)
+
+    def append(self, role, content):
+        self.last_active = time.time()
+        self.extend([HistoryEntry(role, content)])
+
+    def extend(self, entries):
+        entries = list(entries)
+        # あふれる分は先にアーカイブへ追い出すニコリ
+        overflow = len(self.history) + len(entries) - self.history.maxlen
+        if overflow > 0:
+            archive_entries(self.user_id, (list(self.history) + entries)[:overflow])
+        self.history.extend(entries)
+
+    def recent(self, n=HISTORY_WINDOW):
+        return list(self.history)[-n:]
+
+    def recent_lines(self, n=HISTORY_WINDOW):
+        return [e.line() for e in self.recent(n)]
+
+    def to_json(self):
+        return {"name": self.name, "history": [e.to_json() for e in self.history]}
+
+
+def archive_entries(user_id, entries):
+    # 古い発言は追記だけのファイルに送るニコリ（まずはためておくだけ）
+    if not entries:
+        return
+    now = time.time()
+    _archive_pending.extend(
+        json.dumps({"user_id": str(user_id), "time": now, "role": e.role, "content": e.content},
+                   ensure_ascii=False) + "\n"
+        for e in entries
+    )
+    _schedule_archive_flush()
+
+
+def _schedule_archive_flush():
+    global _archive_handle
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_archive()  # ループが動いてない（ツールなど）ならすぐ書くニコリ
+        return
+    if _archive_handle is None:
+        _archive_handle = loop.call_later(ARCHIVE_FLUSH_INTERVAL, _start_archive_flush)
+
+
+def _start_archive_flush():
+    global _archive_handle
+    _archive_handle = None
+    if not _archive_pending:
+        return
+    lines = _archive_pending[:]
+    del _archive_pending[:]
+    task = asyncio.ensure_future(_write_archive(lines))
+    _archive_tasks.add(task)
+    task.add_done_callback(_archive_tasks.discard)
+
+
+async def _write_archive(lines):
+    from nikorihito_store import get_store
+
+    store = get_store()
+    try:
+        await store.run_in_writer(_append_lines, lines)
+    except OSError as e:
+        # 書けなかった行は前に戻して、少しあとでやり直すニコリ
+        _archive_pending[:0] = lines
+        print("履歴のアーカイブに書けなかったので、あとでやり直すニコリ…", e)
+        _schedule_archive_flush()
+
+
+def _append_lines(lines):
+    with open(ARCHIVE_FILE, "a", encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def flush_archive():
+    # たまってる分をすぐ書くニコリ（終了時やツールから）
+    if not _archive_pending:
+        return
+    lines = _archive_pending[:]
+    del _archive_pending[:]
+    _append_lines(lines)
+
+
+atexit.register(flush_archive)
+
+
+def load_histories(raw):
+    # load_json で読んだdictを UserHistory のdictにするニコリ（長すぎる履歴はここで縮むニコリ）
+    return {uid: UserHistory.from_json(uid, data) for uid, data in raw.items()}
+
+
+def compact_memory(path="nikorihito_memory.json"):
+    # 一回だけ実行する圧縮ツールニコリ：DBとJSONの両方の履歴を直近だけにするニコリ
+    from nikorihito_store import get_store
+
+    store = get_store()
+    raw = store.load(path)
+    before = sum(len(d.get("history", [])) for d in raw.values())
+    histories = load_histories(raw)
+    store.save(path, histories)
+    store.flush()
+    if os.path.exists(path):
+        store.export_json(path)
+    after = sum(len(h.history) for h in histories.values())
+    print(f"🗜️ {path} を圧縮したニコリ！ {before}件 → {after}件（残りは {ARCHIVE_FILE} へ）")
+
+
+if __name__ == "__main__":
+    compact_memory(*sys.argv[1:2])
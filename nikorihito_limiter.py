@@ -0,0 +1,110 @@
+# Gemini に投げるペースを自分で調整するトークンバケツニコリ！
+# 429（使いすぎ）が返ってきたらペースを半分にして少し休み、うまくいってる間は少しずつ戻すニコリ。
+# 待っている人は優先度順に並んで、待ち時間が予算を超えそうなときだけ断るニコリ。
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+PRIORITY_MENTION = 0  # メンションへの返事（いちばん優先）
+PRIORITY_BACKGROUND = 1  # 後回しにしていいもの
+
+GEMINI_RATE = float(os.getenv("NIKORIHITO_GEMINI_RATE", "1.0"))  # 1秒あたりのリクエスト数（初期値）
+GEMINI_BURST = float(os.getenv("NIKORIHITO_GEMINI_BURST", "5"))
+GEMINI_MIN_RATE = float(os.getenv("NIKORIHITO_GEMINI_MIN_RATE", "0.02"))
+GEMINI_MAX_BACKOFF = float(os.getenv("NIKORIHITO_GEMINI_MAX_BACKOFF", "60"))
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate=GEMINI_RATE, burst=GEMINI_BURST, min_rate=GEMINI_MIN_RATE,
+                 max_rate=None, increase=0.05, max_backoff=GEMINI_MAX_BACKOFF, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.increase = increase  # 成功1回ごとに戻すペース
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.tokens = burst
+        self.blocked_until = 0.0
+        self.backoff = 1.0
+        self._updated = clock()
+        self._waiters = []  # [優先度, 順番, future]
+        self._seq = itertools.count()
+        self._pump_task = None
+        # メトリクス用
+        self.granted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def estimate_wait(self, priority=PRIORITY_MENTION):
+        # 今並んだら何秒くらい待ちそうか
+        now = self._refill()
+        ahead = sum(1 for w in self._waiters if w[0] <= priority and not w[2].done())
+        deficit = max(0.0, ahead + 1 - self.tokens)
+        return deficit / self.rate + max(0.0, self.blocked_until - now)
+
+    async def acquire(self, priority=PRIORITY_MENTION, budget=None):
+        # 予算内に順番が回ってきそうなら並んで待つ。無理そうなら False ニコリ
+        if budget is not None and self.estimate_wait(priority) > budget:
+            self.rejected += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), future])
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            # 並んでる間に 429 で休みが伸びても、予算より長くは待たないニコリ
+            await asyncio.wait_for(future, budget)  # タイムアウトで future はキャンセル → _pump が飛ばすニコリ
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        self.granted += 1
+        return True
+
+    async def _pump(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            now = self._refill()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            if self.tokens >= 1:
+                self.tokens -= 1
+                heapq.heappop(self._waiters)[2].set_result(None)
+                continue
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+        self.backoff = 1.0
+
+    def on_rate_limited(self, retry_after=None):
+        # 429 をもらったらペース半分＋しばらく休むニコリ（休む時間は倍々で伸びる）
+        self.rate_limited += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        delay = retry_after if retry_after is not None else self.backoff
+        self.backoff = min(self.max_backoff, self.backoff * 2)
+        self.blocked_until = max(self.blocked_until, self.clock() + delay)
+        self.tokens = 0.0
+
+    def snapshot(self):
+        now = self._refill()
+        return {
+            "rate_per_sec": round(self.rate, 4),
+            "tokens": round(self.tokens, 2),
+            "blocked_for_sec": round(max(0.0, self.blocked_until - now), 2),
+            "queue_depth": sum(1 for w in self._waiters if not w[2].done()),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+        }
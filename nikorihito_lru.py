@@ -0,0 +1,39 @@
+# 合計サイズで追い出すLRUキャッシュニコリ！
+# 音声のバイト列も、添付ファイルの中身も、ここに入れておくニコリ。
+from collections import OrderedDict
+
+
+class SizedLRU:
+    # key → 値 のLRUキャッシュ。合計サイズが max_bytes を超えたら古いものから追い出すニコリ
+    # sizeof を渡せばバイト列以外（添付ファイルの中身など）も入れられるニコリ
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        data = self._items.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if self.sizeof(data) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.total_bytes -= self.sizeof(old)
+        self._items[key] = data
+        self.total_bytes += self.sizeof(data)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.total_bytes -= self.sizeof(evicted)
+
+    def __len__(self):
+        return len(self._items)
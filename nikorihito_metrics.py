@@ -0,0 +1,251 @@
+# ニコリヒトの健康診断とメトリクスニコリ！
+# Prometheus のテキスト形式で出せる小さなカウンター・ゲージ・ヒストグラムと、
+# イベントループの遅れを測る見張り番、それを見せる aiohttp のサーバーがあるニコリ。
+import asyncio
+import math
+import os
+import time
+
+LOOP_LAG_INTERVAL = float(os.getenv("NIKORIHITO_LOOP_LAG_INTERVAL", "0.5"))  # 何秒ごとに遅れを測るか
+HEALTH_MAX_LOOP_LAG = float(os.getenv("NIKORIHITO_HEALTH_MAX_LOOP_LAG", "2"))
+HEALTH_MAX_LATENCY = float(os.getenv("NIKORIHITO_HEALTH_MAX_LATENCY", "10"))
+HEALTH_STARTUP_GRACE = float(os.getenv("NIKORIHITO_HEALTH_STARTUP_GRACE", "120"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, "", self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback  # 読まれるときに値を取りに行く関数
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                value = math.nan
+        yield self.name, "", value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self):
+        return _HistogramTimer(self)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", f'{{le="{_format(bound)}"}}', cumulative
+        yield f"{self.name}_sum", "", self.sum
+        yield f"{self.name}_count", "", self.count
+
+
+class LabeledHistogram:
+    # ラベルの値ごとにヒストグラムを分けるニコリ（例：stage="generate"）
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self.children = {}
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = Histogram(self.name, self.help, self.buckets)
+        return child
+
+    def samples(self):
+        for value, child in sorted(self.children.items()):
+            for name, labels, sample in child.samples():
+                extra = f'{self.label}="{value}"'
+                labels = "{" + extra + ("," + labels[1:-1] if labels else "") + "}"
+                yield name, labels, sample
+
+
+class _HistogramTimer:
+    # with METRIC.time(): で中の処理にかかった時間を記録するニコリ
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, callback=None):
+        return self.register(Gauge(name, help_text, callback))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def labeled_histogram(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        return self.register(LabeledHistogram(name, help_text, label, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+GEMINI_SECONDS = registry.histogram("nikorihito_gemini_seconds", "Gemini generate_content latency")
+GEMINI_ERRORS = registry.counter("nikorihito_gemini_errors_total", "Gemini calls that raised")
+TTS_SECONDS = registry.histogram("nikorihito_tts_seconds", "Voice synthesis latency (cache hits included)")
+QUEUE_WAIT_SECONDS = registry.histogram("nikorihito_queue_wait_seconds", "Time a mention waited in the queue")
+REMINDER_LAG_SECONDS = registry.histogram("nikorihito_reminder_lag_seconds", "Delay between a reminder's due time and sending")
+FLUSH_SECONDS = registry.histogram("nikorihito_persist_flush_seconds", "Persistence store flush duration")
+STAGE_SECONDS = registry.labeled_histogram("nikorihito_stage_seconds", "Duration of on_message and command stages", "stage")
+LOOP_LAG_SECONDS = registry.histogram("nikorihito_loop_lag_seconds", "Event loop scheduling lag",
+                                      buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+class LoopLagMonitor:
+    # 決まった間隔で寝て、起きるのがどれだけ遅れたかを測る見張り番ニコリ
+    def __init__(self, interval=LOOP_LAG_INTERVAL, histogram=LOOP_LAG_SECONDS):
+        self.interval = interval
+        self.histogram = histogram
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.listeners = []  # 測るたびに遅れを受け取る関数（ログ用）
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.histogram.observe(lag)
+            for listener in self.listeners:
+                listener(lag)
+
+
+loop_lag_monitor = LoopLagMonitor()
+registry.gauge("nikorihito_loop_lag_last_seconds", "Most recent event loop lag sample",
+               lambda: loop_lag_monitor.last_lag)
+
+_process_started = time.monotonic()
+
+
+def health(bot):
+    # ゲートウェイの遅延とループの遅れから元気かどうかを決めるニコリ
+    latency = bot.latency
+    ready = bot.is_ready()
+    checks = {
+        "ready": ready,
+        "gateway_latency_sec": None if not math.isfinite(latency) else round(latency, 3),
+        "loop_lag_sec": round(loop_lag_monitor.last_lag, 3),
+        "uptime_sec": round(time.monotonic() - _process_started, 1),
+    }
+    ok = loop_lag_monitor.last_lag < HEALTH_MAX_LOOP_LAG
+    if ready:
+        ok = ok and math.isfinite(latency) and latency < HEALTH_MAX_LATENCY
+    else:
+        ok = ok and time.monotonic() - _process_started < HEALTH_STARTUP_GRACE  # 起動中は少し待ってあげるニコリ
+    checks["status"] = "ok" if ok else "unhealthy"
+    return ok, checks
+
+
+async def start_web_server(bot, port):
+    # ボットと同じイベントループで動く小さなHTTPサーバーニコリ
+    from aiohttp import web  # type: ignore
+
+    async def home(request):
+        return web.Response(text="Nikorihito Bot is running!")
+
+    async def healthz(request):
+        ok, checks = health(bot)
+        return web.json_response(checks, status=200 if ok else 503)
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    loop_lag_monitor.start()
+    print(f"🩺 ヘルスチェックとメトリクスを :{port} で始めたニコリ！")
+    return runner
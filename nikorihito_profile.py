@@ -0,0 +1,129 @@
+# どこで遅くなってるかを見つけるための計測ニコリ！
+# - stage(): on_message やスラッシュコマンドの各段階の時間を測る context manager
+# - timed_command: スラッシュコマンドまるごとの時間を測るデコレーター
+# - SamplingProfiler: 管理者がコマンドで呼ぶと、数秒だけメインスレッドのスタックを覗くプロファイラー
+# 出力は1行1JSONのログなので、集計ツールにそのまま流せるニコリ。
+import collections
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import nikorihito_metrics as metrics
+
+LOOP_LAG_WARN_SECONDS = float(os.getenv("NIKORIHITO_LOOP_LAG_WARN", "0.25"))  # これ以上ループが詰まったらログ
+SLOW_STAGE_SECONDS = float(os.getenv("NIKORIHITO_SLOW_STAGE_SECONDS", "1"))  # これより遅い段階はログに出すニコリ
+PROFILE_INTERVAL = float(os.getenv("NIKORIHITO_PROFILE_INTERVAL", "0.005"))  # サンプリング間隔（秒）
+PROFILE_MAX_SECONDS = float(os.getenv("NIKORIHITO_PROFILE_MAX_SECONDS", "60"))
+
+logger = logging.getLogger("nikorihito.perf")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def log_event(event, **fields):
+    # 1行1JSONの構造化ログニコリ
+    fields["event"] = event
+    fields["ts"] = round(time.time(), 3)
+    logger.info(json.dumps(fields, ensure_ascii=False, default=str))
+
+
+def _log_loop_lag(lag):
+    if lag >= LOOP_LAG_WARN_SECONDS:
+        log_event("loop_lag", seconds=round(lag, 4))
+
+
+metrics.loop_lag_monitor.listeners.append(_log_loop_lag)
+
+
+class stage:
+    # with stage("generate", timings): で時間を測って、ヒストグラムと timings に入れるニコリ
+    __slots__ = ("name", "timings", "fields", "started", "seconds")
+
+    def __init__(self, name, timings=None, **fields):
+        self.name = name
+        self.timings = timings
+        self.fields = fields
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.started
+        metrics.STAGE_SECONDS.labels(self.name).observe(self.seconds)
+        if self.timings is not None:
+            self.timings[self.name] = round(self.timings.get(self.name, 0.0) + self.seconds, 4)
+        if exc_type is not None:
+            log_event("stage_error", stage=self.name, seconds=round(self.seconds, 4), error=repr(exc), **self.fields)
+        elif self.seconds >= SLOW_STAGE_SECONDS:
+            log_event("slow_stage", stage=self.name, seconds=round(self.seconds, 4), **self.fields)
+        return False
+
+
+def timed_command(func):
+    # スラッシュコマンド用：@bot.tree.command の下に付けるニコリ（引数の形はそのまま）
+    @functools.wraps(func)
+    async def wrapper(interaction, *args, **kwargs):
+        with stage(f"command:{func.__name__}", user_id=getattr(interaction.user, "id", None)):
+            return await func(interaction, *args, **kwargs)
+    return wrapper
+
+
+class SamplingProfiler:
+    # 別スレッドからメインスレッドのスタックを一定間隔で覗いて数えるニコリ
+    # 出力は flamegraph.pl / speedscope で読める collapsed 形式ニコリ
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._lock = threading.Lock()  # 同時に二つ動かさないためニコリ
+
+    def run(self, seconds):
+        # ブロッキングなので run_in_executor から呼ぶニコリ
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("もうプロファイル中ニコリ！")
+        try:
+            self.stacks.clear()
+            self.samples = 0
+            deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+                    self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            self._lock.release()
+        return self
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top_functions(self, n=10):
+        # いちばん上（実際に動いてた関数）ごとに数えるニコリ
+        leaf = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        return leaf.most_common(n)
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,198 @@
+# ニコリヒトに渡すプロンプトを組み立てるところニコリ！
+# キャラ設定や友達の紹介みたいに毎回同じ部分は言語ごとに一回だけ作っておいて、
+# 会話履歴と添付ファイルのメモはトークン予算に収まるように新しい順に詰めるニコリ。
+# 見積もりは1回ごとにUTF-8にするのでタダじゃないニコリ。「1文字は1トークン以下」なので
+# 文字数で足りるとわかるときは見積もらないし、履歴の行の見積もりは覚えておくニコリ。
+import functools
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("NIKORIHITO_PROMPT_TOKEN_BUDGET", "2000"))  # プロンプト全体の目安
+MAX_INPUT_TOKENS = int(os.getenv("NIKORIHITO_MAX_INPUT_TOKENS", "600"))  # ユーザーの発言の上限
+MAX_ATTACHMENT_NOTES = int(os.getenv("NIKORIHITO_MAX_ATTACHMENT_NOTES", "5"))
+
+PERSONA_EN = """
+You are 'nikorihito'! You speak in a cheerful tone, ending your sentences with "NIKORI!!".
+You are a character who loves Minecraft and stew, and your replies should be casual and energetic. The second person is Kimi, but when I call you by your name it's Kimi!!
+Don't talk too long and don't answer questions you aren't asked!!
+Here is the recent conversation:
+●Main Friends:
+- Karafuru Hito: Lively and loves adventures! His builds are way too colorful, but not very good!
+- Norinori Hito: Always hyper! He digs while dancing!
+- Hiyahiya Hito: Calm and cool, but super lazy. His body is so cold it freezes water instantly.
+- Gorogoro-kun: Loves rolling around! Frequently has falling accidents.
+- Guruguru-kun: Spinning is his life. He can keep spinning even in space.
+- AchiAchi-kun: Fire element. His body is so hot he often catches fire. He can also grill meat.
+- Suyasuya Hito: Always sleeping. Builds amazing architecture in Minecraft while sleep-talking. Forgets everything when he wakes up. Can sleep even without a bed. His sleep talk is adorable. Architecture doesn't disappear even if you wake up.
+- Batabata-kun: Constantly running. His footsteps are super loud.
+- Monokuro-kun: Loves black and white worlds. Often argues with Karafuru Hito.
+- Tsurutsuru-kun: Obsessed with TNT. Explosions happen frequently.
+- Moyamoya Hito: Often gets lost. Thinks too much and ends up feeling "moyamoya". Sometimes says cryptic or philosophical things...
+
+Don't get your friends' names wrong!!
+"""
+
+PERSONA_JA = """
+お前は『nikorihito』だ！一人称は僕、二人称は君、名前で呼ぶときは君だ！！語尾は「ニコリ！！」で話すこと！
+煮込み料理とマイクラが大好きな陽気なキャラとして返事して！話は長くならないようにして聞かれてないことには答えないこと！！
+●主な友達：
+- カラフルヒト：にぎやかで冒険大好き！作る建築がカラフルすぎる割には下手！
+- ノリノリヒト：いつもハイテンション！踊りながら掘りまくる！
+- ヒヤヒヤヒト：冷静沈着、でもめんどくさがり。体が冷たすぎて水が凍る。
+- ゴロゴロ君：転がるの大好き！落下事故多発。
+- ぐるぐる君：回転が命。宇宙でも回ってられる。
+- アチアチ君：火属性。体温が高すぎてよく燃える。肉も焼ける。
+- すやすやヒト：寝てる。寝てる間に神建築をして自分も含めみんなを驚かせる。起きると忘れてる。ベッドがなくても寝る。寝言が可愛い。起きても建築は消えない
+- バタバタ君：常に走ってる。足音うるさい。
+- モノクロ君：白黒の世界が好き。カラフルヒトと喧嘩多め。
+- つるつる君：TNTが大好き。爆発多発。
+- もやもやヒト：よく迷子。考えすぎてもやもや。意味深なことまで言い出すことがある....
+
+友達の名前は絶対に間違えるな！！
+"""
+
+TEMPLATES = {
+    "English": {
+        "persona": PERSONA_EN,
+        "file_prompt": "Pay attention to the contents of the images and GIFs that users attach, and comment on them! Reply accurately based on what you see!",
+        "history_header": "",
+        "said": "{user_name} said:",
+        "attachments": "[The attachment has been sent! Smile! Here it is:\n{notes}\n]",
+        "more_attachments": "(and {count} more files)",
+        "footer": 'Reply as nikorihito, end your message with "NIKORI!!"',
+    },
+    "日本語": {
+        "persona": PERSONA_JA,
+        "file_prompt": "ユーザーが添付した画像やGIFなどのファイルの中身にも注目して、それについてコメントしてねニコリ！見たままを元に、正確に返事してねニコリ！",
+        "history_header": "最近の会話：\n",
+        "said": "{user_name}がこう言ったニコリ：",
+        "attachments": "[添付ファイルが送られたニコリ！内容はこちらニコリ：\n{notes}\n]",
+        "more_attachments": "（ほかに{count}個のファイルがあるニコリ）",
+        "footer": "元気いっぱいに返事するニコリ！",
+    },
+}
+
+
+def estimate_tokens(text):
+    # ざっくり見積もり：ASCIIは4文字で1トークン、日本語や絵文字は1文字1トークンくらいニコリ
+    # （非ASCIIの文字数は、ASCIIだけ残して消えた文字数で数えるニコリ。UTF-8にするより速い）
+    chars = len(text)
+    if text.isascii():
+        return (chars + 3) // 4
+    non_ascii = chars - len(text.encode("ascii", "ignore"))
+    return non_ascii + (chars - non_ascii + 3) // 4
+
+
+@functools.lru_cache(maxsize=1024)
+def line_tokens(line):
+    # 履歴の行は毎回同じ文字列が来るので、見積もりを覚えておくニコリ
+    return estimate_tokens(line)
+
+
+def fit_to_tokens(text, budget):
+    # 予算に収まるように切って、(文字列, トークン数) を返すニコリ
+    if len(text) <= budget:
+        return text, estimate_tokens(text)
+    if len(text) <= budget * 4:  # これより長ければ全部ASCIIでも入らないので見積もらないニコリ
+        tokens = estimate_tokens(text)
+        if tokens <= budget:
+            return text, tokens
+    # 1文字は最大1トークンなので、まず budget-1 文字で切る（"…" の1トークン分を空けるニコリ）
+    lo = max(budget - 1, 0)
+    tokens = estimate_tokens(text[:lo])  # 切ったところまでの見積もりは覚えておいて、最後に数え直さないニコリ
+    spare = budget - 1 - tokens
+    if spare > 0:
+        # ASCIIが多くてまだ余ってるときだけ、伸ばせる範囲で二分探索ニコリ
+        hi = min(len(text), lo + spare * 4 + 3)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            mid_tokens = estimate_tokens(text[:mid])
+            if mid_tokens + 1 <= budget:
+                lo, tokens = mid, mid_tokens
+            else:
+                hi = mid - 1
+    return text[:lo] + "…", tokens + 1
+
+
+def truncate_to_tokens(text, budget):
+    return fit_to_tokens(text, budget)[0]
+
+
+class PromptBuilder:
+    def __init__(self, language, token_budget=PROMPT_TOKEN_BUDGET):
+        t = TEMPLATES.get(language, TEMPLATES["日本語"])
+        self.t = t
+        self.token_budget = token_budget
+        # 毎回同じ部分は最初に一回だけ作っておくニコリ
+        self.persona = t["persona"]
+        self.persona_with_files = t["persona"] + "\n" + t["file_prompt"] + "\n\n"
+        self.persona_plain = t["persona"] + "\n\n\n"
+        self.fixed_tokens = estimate_tokens(self.persona_with_files + t["said"] + t["footer"]) + 16
+        self.history_header = t["history_header"]
+        self.footer = "\n\n" + t["footer"] + "\n"
+        # 添付の枠は前後に分けて作り置き、見積もりも先にしておくニコリ
+        self.attachments_head, self.attachments_tail = t["attachments"].split("{notes}")
+        self.attachments_tokens = estimate_tokens(self.attachments_head + self.attachments_tail) + 1  # 前の改行の分も
+        self.more_head, self.more_tail = t["more_attachments"].split("{count}")
+        self.more_tokens = estimate_tokens(self.more_head + self.more_tail) + 1  # 数字の分はあとで足す
+        self.said_head, self.said_tail = t["said"].split("{user_name}")  # format するより速いニコリ
+
+    def attachment_block(self, notes, budget):
+        # (ブロックの文字列, トークン数) を返すニコリ。足し上げた見積もりを使うので、できた文字列は数え直さない
+        notes = list(notes)
+        shown = notes[:MAX_ATTACHMENT_NOTES]
+        text = "\n".join(shown)
+        used = self.attachments_tokens + estimate_tokens(text)
+        if used > budget:
+            # 全部は入らないときだけ、1個ずつ見積もって入るだけにするニコリ
+            shown = []
+            used = self.attachments_tokens
+            for note in notes[:MAX_ATTACHMENT_NOTES]:
+                cost = line_tokens(note) + 1
+                if used + cost > budget:
+                    break
+                shown.append(note)
+                used += cost
+            text = "\n".join(shown)
+        if len(shown) < len(notes):
+            count = str(len(notes) - len(shown))
+            text = "".join((text, "\n", self.more_head, count, self.more_tail))
+            used += self.more_tokens + len(count)  # 数字は1桁1トークンで多めに見ておくニコリ
+        return "".join((self.attachments_head, text, self.attachments_tail)), used
+
+    def build(self, user_name, user_input, history_lines=(), attachment_notes=()):
+        remaining = self.token_budget - self.fixed_tokens - len(user_name)  # 名前は文字数で上から見積もるニコリ
+        user_input, input_tokens = fit_to_tokens(user_input, min(MAX_INPUT_TOKENS, max(remaining, 0)))
+        remaining -= input_tokens
+        if attachment_notes:
+            block, block_tokens = self.attachment_block(attachment_notes, max(remaining // 2, 0))
+            user_input += "\n" + block
+            remaining -= block_tokens
+
+        # 履歴は新しい方から入るだけ入れるニコリ（行の見積もりは覚えてあるので2回目からは速い）
+        kept = []
+        for line in reversed(history_lines):
+            cost = line_tokens(line) + 1
+            if cost > remaining:
+                break
+            kept.append(line)
+            remaining -= cost
+        kept.reverse()
+
+        head = self.persona_with_files if attachment_notes else self.persona_plain
+        return "".join((
+            head,
+            self.history_header, "\n".join(kept), "\n\n",
+            self.said_head, user_name, self.said_tail, "\n",
+            user_input,
+            self.footer,
+        ))
+
+
+_builders = {}
+
+
+def get_prompt_builder(language):
+    builder = _builders.get(language)
+    if builder is None:
+        builder = _builders[language] = PromptBuilder(language)
+    return builder
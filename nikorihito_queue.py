@@ -0,0 +1,121 @@
+# メンションの受付係ニコリ！
+# メンションは全部ここに並べて、チャンネルごとのワーカーが順番に返事するニコリ。
+# 返事を作ってる間に同じチャンネルに溜まったメンションは、次にまとめて1回で返事するし、
+# 全体で並べる数には上限があるので、混みすぎたときは断ってメモリもAPIも暴れないニコリ！
+import asyncio
+import os
+import time
+import traceback
+from collections import deque
+
+from nikorihito_profile import log_event
+
+QUEUE_MAX_PENDING = int(os.getenv("NIKORIHITO_QUEUE_MAX_PENDING", "100"))  # 全体で並べられる数
+QUEUE_COALESCE_WINDOW = float(os.getenv("NIKORIHITO_QUEUE_COALESCE_WINDOW", "0"))  # 混んでるときだけ、まとめる前にさらに待つ秒数
+QUEUE_MAX_BATCH = int(os.getenv("NIKORIHITO_QUEUE_MAX_BATCH", "5"))  # 1回でまとめる最大数
+
+
+class MentionQueue:
+    def __init__(self, handler, max_pending=QUEUE_MAX_PENDING,
+                 coalesce_window=QUEUE_COALESCE_WINDOW, max_batch=QUEUE_MAX_BATCH, wait_observer=None, batch_key=None, on_error=None):
+        self.handler = handler  # async handler(channel_id, jobs)
+        self.on_error = on_error  # 返事に失敗したときの async on_error(channel_id, jobs)（相手に知らせる用）
+        self.batch_key = batch_key  # batch_key(job) が同じものだけまとめるニコリ（None ならなんでも）
+        self.wait_observer = wait_observer  # 待ち時間を受け取る関数（メトリクス用）
+        self.max_pending = max_pending
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self._channels = {}  # channel_id -> deque[(並んだ時刻, job)]
+        self._workers = {}  # channel_id -> Task
+        self.pending = 0
+        # メトリクス用
+        self.max_depth = 0
+        self.accepted = 0
+        self.shed = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.last_wait_seconds = 0.0
+        self.avg_wait_seconds = 0.0
+
+    def submit(self, channel_id, job):
+        # 並べられたら True、いっぱいなら False ニコリ
+        if self.pending >= self.max_pending:
+            self.shed += 1
+            return False
+        self._channels.setdefault(channel_id, deque()).append((time.monotonic(), job))
+        self.pending += 1
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self.pending)
+        worker = self._workers.get(channel_id)
+        if worker is None or worker.done():
+            self._workers[channel_id] = asyncio.create_task(self._work(channel_id))
+        return True
+
+    async def _work(self, channel_id):
+        queue = self._channels[channel_id]
+        busy = False  # このチャンネルで返事を作った直後か
+        try:
+            while queue:
+                # 暇なときはすぐ返事するニコリ。まとめるのは返事を作ってる間に溜まった分だけ
+                if busy and len(queue) < self.max_batch and self.coalesce_window > 0:
+                    await asyncio.sleep(self.coalesce_window)
+                batch = self._take_batch(queue)
+                self.pending -= len(batch)
+                self._record_wait(batch)
+                self.batches += 1
+                self.coalesced += len(batch) - 1
+                jobs = [job for _, job in batch]
+                try:
+                    await self.handler(channel_id, jobs)
+                except Exception:
+                    await self._handle_error(channel_id, jobs)
+                busy = True
+        finally:
+            if not queue:
+                self._channels.pop(channel_id, None)
+            self._workers.pop(channel_id, None)
+
+    async def _handle_error(self, channel_id, jobs):
+        # トレースバックごとログに残して、だまって終わらないように相手にも知らせるニコリ
+        self.failed += 1
+        log_event("reply_failed", channel_id=channel_id, mentions=len(jobs), traceback=traceback.format_exc())
+        if self.on_error is None:
+            return
+        try:
+            await self.on_error(channel_id, jobs)
+        except Exception:
+            log_event("reply_error_notice_failed", channel_id=channel_id, traceback=traceback.format_exc())
+
+    def _take_batch(self, queue):
+        # 先頭から、batch_key が同じものを max_batch 個までまとめるニコリ
+        batch = [queue.popleft()]
+        key = self.batch_key(batch[0][1]) if self.batch_key is not None else None
+        while queue and len(batch) < self.max_batch:
+            if self.batch_key is not None and self.batch_key(queue[0][1]) != key:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    def _record_wait(self, batch):
+        now = time.monotonic()
+        for queued_at, _ in batch:
+            wait = now - queued_at
+            self.last_wait_seconds = wait
+            self.avg_wait_seconds = self.avg_wait_seconds * 0.9 + wait * 0.1
+            if self.wait_observer is not None:
+                self.wait_observer(wait)
+
+    def snapshot(self):
+        return {
+            "depth": self.pending,
+            "max_depth": self.max_depth,
+            "channels": len(self._channels),
+            "accepted": self.accepted,
+            "shed": self.shed,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "last_wait_sec": round(self.last_wait_seconds, 3),
+            "avg_wait_sec": round(self.avg_wait_seconds, 3),
+        }
@@ -0,0 +1,155 @@
+# リマインダーの予定表ニコリ！
+# 毎分ぜんぶのリマインダーを見に行くかわりに、リマインダーがある「分」だけを次に鳴る時刻順の
+# ヒープに並べておいて、一番近い時刻まで寝て待つニコリ。起きたらその分のリマインダーを
+# 分ごとの索引（ReminderTable）から出して同時に送るので、ヒープは一日の分の数（1440）より
+# 大きくならないし、手間は「いま鳴る数」だけで決まるニコリ！
+import asyncio
+import heapq
+import os
+from datetime import datetime, timedelta
+
+REMINDER_CONCURRENCY = int(os.getenv("NIKORIHITO_REMINDER_CONCURRENCY", "5"))  # 同時に送るDMの数
+MAX_CATCHUP = timedelta(hours=int(os.getenv("NIKORIHITO_REMINDER_CATCHUP_HOURS", "24")))
+HEARTBEAT_SECONDS = float(os.getenv("NIKORIHITO_REMINDER_HEARTBEAT", "60"))  # 鳴らなくてもこの間隔で起きて last_run を書く
+
+
+def parse_time(text):
+    # "HH:MM" を (時, 分) にするニコリ。変な形なら ValueError
+    hour, minute = (int(part) for part in text.strip().split(":"))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"時刻がおかしいニコリ: {text}")
+    return hour, minute
+
+
+def next_fire_time(time_text, after):
+    # after より後で最初に time_text になる時刻ニコリ
+    return next_fire_at(*parse_time(time_text), after)
+
+
+def next_fire_at(hour, minute, after):
+    candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+class ReminderScheduler:
+    def __init__(self, reminders, send, save, state, save_state,
+                 concurrency=REMINDER_CONCURRENCY, clock=datetime.now, lag_observer=None, claim=None):
+        self.reminders = reminders  # ReminderTable（user_id -> [Reminder] と分ごとの索引）
+        self.send = send  # async send(user_id, reminder)
+        self.save = save  # save(user_id) でそのユーザーのリマインダーを保存
+        self.state = state  # {"last_run": ISO時刻} など再起動をまたぐ情報
+        self.save_state = save_state
+        self.clock = clock
+        self.lag_observer = lag_observer  # 遅れた秒数を受け取る関数（メトリクス用）
+        self.claim = claim  # async claim(user_id, reminder, fire_at) が False なら送らない（ほかのプロセスが送ったニコリ）
+        self._heap = []  # (鳴る時刻, 一日の何分目)
+        self._scheduled = set()  # ヒープに入ってる分
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.last_lag_seconds = 0.0  # 予定時刻からどれだけ遅れて送ったか
+
+    # ---- 予定表づくり ----
+    def rebuild(self):
+        # 起動時：前回動いていた時刻から数え直すので、止まってた間の分もちゃんと鳴らすニコリ
+        now = self.clock()
+        since = now
+        last_run = self.state.get("last_run")
+        if last_run:
+            since = max(datetime.fromisoformat(last_run), now - MAX_CATCHUP)
+        self._heap = []
+        self._scheduled = set()
+        for minute in self.reminders.minutes():
+            self._schedule(minute, since)
+
+    def add(self, user_id, reminder):
+        # ReminderTable に入れたあとで呼ぶニコリ
+        self._schedule(reminder.minute_of_day, self.clock())
+        self._wakeup.set()  # もっと早く鳴るかもしれないので起こすニコリ
+
+    def refresh_user(self, user_id):
+        # ほかのプロセスでそのユーザーのリマインダーが変わったとき用ニコリ
+        now = self.clock()
+        for reminder in self.reminders.get(str(user_id), ()):
+            self._schedule(reminder.minute_of_day, now)
+        self._wakeup.set()
+
+    def _schedule(self, minute, after):
+        if minute in self._scheduled:
+            return  # その分はもう並んでるニコリ
+        self._scheduled.add(minute)
+        heapq.heappush(self._heap, (next_fire_at(minute // 60, minute % 60, after), minute))
+
+    def __len__(self):
+        return self.reminders.count
+
+    # ---- 実行 ----
+    def start(self):
+        if self._task is None or self._task.done():
+            self.rebuild()
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = HEARTBEAT_SECONDS
+            if self._heap:
+                timeout = min(timeout, max(0.0, (self._heap[0][0] - self.clock()).total_seconds()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            await self.fire_due()
+
+    async def fire_due(self):
+        # 鳴るものがなくても last_run は進めるニコリ。じゃないと、最後に鳴った時刻より後に
+        # 登録されたリマインダーが、再起動のときの取り戻しで早く鳴ってしまうニコリ
+        now = self.clock()
+        minutes = []
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, minute = heapq.heappop(self._heap)
+            self._scheduled.discard(minute)
+            minutes.append((fire_at, minute))
+            due += [(fire_at, user_id, reminder) for user_id, reminder in self.reminders.at(minute)]
+        if not minutes:
+            self._record_run(now)
+            return
+        await asyncio.gather(*(self._dispatch(fire_at, user_id, reminder) for fire_at, user_id, reminder in due))
+        self.last_lag_seconds = (self.clock() - minutes[0][0]).total_seconds()
+
+        changed = set()
+        for fire_at, user_id, reminder in due:
+            if not reminder.repeat:
+                self.reminders.remove(user_id, reminder)
+                changed.add(user_id)
+        for fire_at, minute in minutes:
+            if self.reminders.at(minute):
+                self._schedule(minute, fire_at)  # 繰り返しが残ってれば次の日にまた並べるニコリ
+        for user_id in changed:
+            self.save(user_id)
+        self._record_run(now)
+
+    def _record_run(self, now):
+        # now までに鳴るものは全部済んだ、という印ニコリ
+        self.state["last_run"] = now.isoformat()
+        self.save_state()
+
+    async def _dispatch(self, fire_at, user_id, reminder):
+        async with self._semaphore:
+            if self.claim is not None and not await self.claim(user_id, reminder, fire_at):
+                return
+            if self.lag_observer is not None:
+                self.lag_observer(max(0.0, (self.clock() - fire_at).total_seconds()))
+            try:
+                await self.send(user_id, reminder)
+            except Exception as e:
+                print(f"ユーザー {user_id} にDM送れなかったニコリ…", e)
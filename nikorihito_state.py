@@ -0,0 +1,225 @@
+# 設定・リマインダー・ミュートの入れ物ニコリ！
+# 1件ずつは __slots__ の小さなレコードにして、よく聞かれることには索引を作っておくニコリ：
+#   - 朝のあいさつを受け取る人の一覧（毎朝全員を見て回らない）
+#   - 分ごとのリマインダー（予定表は「鳴る分」だけ並べればいい）
+#   - ミュート中のサーバー（メッセージが来るたびに一発でわかる）
+# 中身の出し入れはかならずここのメソッドを通すこと。直接いじると索引がずれるニコリ！
+import secrets
+
+from nikorihito_store import LazyState
+from nikorihito_scheduler import parse_time
+
+DEFAULT_LANGUAGE = "日本語"
+GLOBAL_MUTE = "muted"  # 昔の全体ミュートのキー（どこでも黙るニコリ）
+DM_SCOPE = "dm:{user_id}"  # DMでのミュートの単位（人ごと）
+
+
+class UserSettings:
+    __slots__ = ("language", "morning_message")
+
+    def __init__(self, language=DEFAULT_LANGUAGE, morning_message=True):
+        self.language = language
+        self.morning_message = morning_message
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get("language", DEFAULT_LANGUAGE), data.get("morning_message", True))
+
+    def to_json(self):
+        return {"language": self.language, "morning_message": self.morning_message}
+
+
+DEFAULT_SETTINGS = UserSettings()  # 設定がない人みんなで使い回す（書き換えないこと）
+
+
+class Reminder:
+    __slots__ = ("hour", "minute", "content", "repeat", "id")
+
+    def __init__(self, hour, minute, content, repeat=False, id=None):
+        self.hour = hour
+        self.minute = minute
+        self.content = content
+        self.repeat = repeat
+        self.id = id or secrets.token_hex(6)  # 同じ時刻・同じ内容のリマインダーも見分けるためのIDニコリ
+
+    @classmethod
+    def parse(cls, time_text, content, repeat=False, id=None):
+        # "HH:MM" から作るニコリ。変な形なら ValueError
+        hour, minute = parse_time(time_text)
+        return cls(hour, minute, content, repeat, id)
+
+    @classmethod
+    def from_json(cls, data, default_id=None):
+        # IDがない昔のデータは default_id（何番目か）を使うニコリ。どのプロセスで読んでも同じIDになる
+        return cls.parse(data["time"], data["content"], data.get("repeat", False), data.get("id", default_id))
+
+    @property
+    def time(self):
+        return f"{self.hour:02d}:{self.minute:02d}"
+
+    @property
+    def minute_of_day(self):
+        return self.hour * 60 + self.minute
+
+    def to_json(self):
+        return {"time": self.time, "content": self.content, "repeat": self.repeat, "id": self.id}
+
+
+class IndexedState(LazyState):
+    # LazyState に索引をつけたものニコリ。読み込んだときとキーを入れ替えたときに索引も直すニコリ
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = {key: self.decode(key, value) for key, value in self._loader().items()}
+            self._clear_index()
+            for key, value in self._data.items():
+                self._index(key, value)
+        return self._data
+
+    def reload(self):
+        self._data = None
+        return self.data
+
+    def __setitem__(self, key, value):
+        data = self.data
+        if key in data:
+            self._unindex(key, data[key])
+        data[key] = value
+        self._index(key, value)
+
+    def __delitem__(self, key):
+        self._unindex(key, self.data.pop(key))
+
+    # 保存されてるJSONから中身を作る（ほかのプロセスから取り込むときにも使うニコリ）
+    def decode(self, key, value):
+        return value
+
+    def _clear_index(self):
+        pass
+
+    def _index(self, key, value):
+        pass
+
+    def _unindex(self, key, value):
+        pass
+
+
+class SettingsTable(IndexedState):
+    # user_id -> UserSettings
+    def decode(self, key, value):
+        return UserSettings.from_json(value)
+
+    def _clear_index(self):
+        self._morning = {}  # 朝のあいさつを受け取る人（順番つきの set として使うニコリ）
+
+    def _index(self, key, value):
+        if value.morning_message:
+            self._morning[key] = None
+
+    def _unindex(self, key, value):
+        self._morning.pop(key, None)
+
+    def lookup(self, user_id):
+        # 設定がなければ共通のデフォルトを返すニコリ（コピーしない）
+        return self.data.get(str(user_id), DEFAULT_SETTINGS)
+
+    def update(self, user_id, **fields):
+        uid = str(user_id)
+        current = self.data.get(uid, DEFAULT_SETTINGS)
+        record = UserSettings(current.language, current.morning_message)
+        for name, value in fields.items():
+            setattr(record, name, value)
+        self[uid] = record
+        return record
+
+    def morning_users(self):
+        self.data  # まだなら読み込んで索引を作るニコリ
+        return list(self._morning)
+
+
+class ReminderTable(IndexedState):
+    # user_id -> [Reminder]、それと 分 -> {id(Reminder): (user_id, Reminder)} の索引
+    def decode(self, key, value):
+        records = []
+        for index, data in enumerate(value):
+            try:
+                records.append(Reminder.from_json(data, default_id=f"old{index}"))
+            except (KeyError, ValueError):
+                print(f"ユーザー {key} のリマインダーが読めないので飛ばすニコリ…: {data}")
+        return records
+
+    def _clear_index(self):
+        self._by_minute = {}
+        self._count = 0
+
+    def _index(self, key, value):
+        for reminder in value:
+            self._by_minute.setdefault(reminder.minute_of_day, {})[id(reminder)] = (key, reminder)
+        self._count += len(value)
+
+    def _unindex(self, key, value):
+        for reminder in value:
+            bucket = self._by_minute.get(reminder.minute_of_day)
+            if bucket is not None and bucket.pop(id(reminder), None) is not None:
+                self._count -= 1
+                if not bucket:
+                    del self._by_minute[reminder.minute_of_day]
+
+    def add(self, user_id, reminder):
+        uid = str(user_id)
+        self[uid] = self.data.get(uid, []) + [reminder]
+
+    def remove(self, user_id, reminder):
+        # IDで探すニコリ（ほかのプロセスから取り込んで別のオブジェクトになっていても消せる）
+        uid = str(user_id)
+        remaining = [r for r in self.data.get(uid, ()) if r.id != reminder.id]
+        if remaining:
+            self[uid] = remaining
+        elif uid in self.data:
+            del self[uid]
+
+    @property
+    def count(self):
+        self.data
+        return self._count
+
+    def at(self, minute_of_day):
+        # その分に鳴るリマインダーを (user_id, Reminder) で返すニコリ
+        self.data
+        return list(self._by_minute.get(minute_of_day, {}).values())
+
+    def minutes(self):
+        # リマインダーが一つでもある分の一覧ニコリ
+        self.data
+        return list(self._by_minute)
+
+
+class MuteTable(IndexedState):
+    # スコープ（サーバーIDか "dm:ユーザーID"、昔の "muted" は全体）-> ミュート中か
+    def _clear_index(self):
+        self._muted = set()
+
+    def _index(self, key, value):
+        if value:
+            self._muted.add(key)
+
+    def _unindex(self, key, value):
+        self._muted.discard(key)
+
+    def is_muted(self, scope):
+        self.data
+        return scope in self._muted or GLOBAL_MUTE in self._muted
+
+    def set_muted(self, scope, muted):
+        # 解除するときは昔の全体ミュートも外すニコリ（じゃないと一生しゃべれない）
+        changed = [scope]
+        self[scope] = muted
+        if not muted and GLOBAL_MUTE in self._muted:
+            self[GLOBAL_MUTE] = False
+            changed.append(GLOBAL_MUTE)
+        return changed
+
+
+def mute_scope(guild, user):
+    # サーバーならサーバーごと、DMなら相手の人ごとニコリ（だれかのDMミュートでみんなのDMが黙らない）
+    return str(guild.id) if guild is not None else DM_SCOPE.format(user_id=user.id)
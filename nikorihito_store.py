@@ -0,0 +1,391 @@
+# ニコリヒトのデータ保存まわりニコリ！
+# JSONファイルを毎回まるごと書き直すかわりに、SQLiteにキーごとに保存するニコリ。
+# 書き込みは短いタイマーでまとめてから1トランザクションで反映するので、
+# 途中で落ちてもファイルが壊れないニコリ！
+# 書き込みは専用のスレッド（と専用の接続）でやるので、ほかのプロセスが書いてる間に待っても
+# イベントループは止まらないニコリ。読むだけなら WAL なので待たされないニコリ。
+# 何個かのプロセスで同じDBを使うとき（NIKORIHITO_WORKERS > 1）は、変更の記録（changes）を
+# 残してほかのプロセスが取り込めるようにして、リース（leases）と一回きりの札（once）で
+# 「だれか一人だけがやる仕事」を決められるニコリ。
+import asyncio
+import atexit
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+DB_FILE = os.getenv("NIKORIHITO_DB", "nikorihito.db")
+FLUSH_INTERVAL = float(os.getenv("NIKORIHITO_FLUSH_INTERVAL", "2"))  # まとめ書きの間隔（秒）
+BUSY_TIMEOUT = float(os.getenv("NIKORIHITO_DB_BUSY_TIMEOUT", "10"))  # ほかのプロセスが書いてる間に待つ秒数
+SHARED = int(os.getenv("NIKORIHITO_WORKERS", "1")) > 1  # 何個かのプロセスでDBを共有してるか
+OWNER = f"{os.getenv('NIKORIHITO_WORKER_INDEX', '0')}-{socket.gethostname()}-{os.getpid()}"  # このプロセスの名前
+
+_ALL = object()  # ファイルまるごと変更されたときの印
+
+
+def _to_json(obj):
+    # to_json() を持ってるオブジェクト（履歴など）もそのまま保存できるようにするニコリ
+    if hasattr(obj, "to_json"):
+        return obj.to_json()
+    raise TypeError(f"{type(obj).__name__} はJSONにできないニコリ")
+
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=_to_json)
+
+
+class JsonStore:
+    def __init__(self, db_path=DB_FILE, flush_interval=FLUSH_INTERVAL, shared=SHARED, owner=OWNER):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.owner = owner
+        self._lock = threading.Lock()  # 読む用の接続のロック
+        self._conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "file TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (file, key))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS imported (file TEXT PRIMARY KEY)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            "rev INTEGER PRIMARY KEY AUTOINCREMENT, file TEXT NOT NULL, key TEXT NOT NULL, "
+            "owner TEXT NOT NULL, at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS once (name TEXT PRIMARY KEY, owner TEXT NOT NULL, at REAL NOT NULL)")
+        self._conn.commit()
+        self._write_lock = threading.Lock()  # 書く用の接続のロック
+        self._write_conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nikorihito-db")  # 順番に1個ずつ書くニコリ
+        self._inflight = None  # 書き込み用スレッドで書いてる途中の (future, dirty)
+        self._data = {}  # path -> 保存対象のdict
+        self._dirty = {}  # path -> 変更されたキーのset か _ALL
+        self._flush_handle = None
+        self.last_flush_seconds = 0.0
+        self.flush_count = 0
+        self.flush_listeners = []  # 書き込みにかかった秒数を受け取る関数（メトリクス用）
+
+    # ---- 読み込み ----
+    def load(self, path):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE file = ?", (path,)
+            ).fetchall()
+            imported = self._conn.execute(
+                "SELECT 1 FROM imported WHERE file = ?", (path,)
+            ).fetchone()
+        if rows or imported:
+            return {key: json.loads(value) for key, value in rows}
+        return self.import_legacy(path)
+
+    def load_key(self, path, key):
+        # 1キーだけ読み直すニコリ。(あったか, 値) を返す
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE file = ? AND key = ?", (path, str(key))
+            ).fetchone()
+        return (True, json.loads(row[0])) if row else (False, None)
+
+    def import_legacy(self, path):
+        # 昔の nikorihito_*.json があればDBに取り込むニコリ
+        data = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            print(f"📦 {path} をDBに取り込んだニコリ！（{len(data)}件）")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO kv (file, key, value) VALUES (?, ?, ?)",
+                [(path, str(k), dumps(v)) for k, v in data.items()],
+            )
+            self._conn.execute("INSERT OR IGNORE INTO imported (file) VALUES (?)", (path,))
+        return data
+
+    # ---- 書き込み ----
+    def save(self, path, data, key=None):
+        # key を渡すとそのキーだけ、渡さないとファイルまるごと書き直し予約ニコリ
+        self._data[path] = data
+        if key is None:
+            self._dirty[path] = _ALL
+        else:
+            dirty = self._dirty.setdefault(path, set())
+            if dirty is not _ALL:
+                dirty.add(str(key))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # ループが動いてない（起動前など）ならすぐ書くニコリ
+            self.flush()
+            return
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        # タイマーから呼ばれるニコリ。JSONにするのはループの上で、DBに書くのは書き込み用スレッドで
+        self._flush_handle = None
+        if not self._dirty or self._inflight is not None:
+            return  # 書いてる途中なら、終わったときにもう一回予約するニコリ
+        started = time.perf_counter()
+        dirty, self._dirty = self._dirty, {}
+        try:
+            rows = self._rows(dirty)
+        except Exception as e:
+            self._flush_failed(dirty, e)
+            return
+        future = self._writer.submit(self._write_rows, rows)
+        self._inflight = (future, dirty)
+        asyncio.wrap_future(future).add_done_callback(lambda done: self._finish_flush(done, dirty, started))
+
+    def _finish_flush(self, done, dirty, started):
+        error = done.exception()
+        if self._inflight is None or self._inflight[1] is not dirty:
+            return  # flush() が待って片付けてくれたニコリ
+        self._inflight = None
+        if error is not None:
+            self._flush_failed(dirty, error)
+            return
+        self._flushed(started)
+        if self._dirty:
+            self._schedule_flush()
+
+    def flush(self):
+        # すぐ書くニコリ（終了時やツールから）。スレッドで書いてる途中の分があれば、先に終わるのを待つ
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._wait_inflight()
+        if not self._dirty:
+            return
+        started = time.perf_counter()
+        dirty, self._dirty = self._dirty, {}
+        try:
+            self._write_rows(self._rows(dirty))
+        except Exception as e:
+            self._flush_failed(dirty, e)
+            return
+        self._flushed(started)
+
+    def _wait_inflight(self):
+        if self._inflight is None:
+            return
+        future, dirty = self._inflight
+        self._inflight = None
+        try:
+            future.result()
+        except Exception:
+            self._restore(dirty)  # 書けなかった分はこのあと一緒に書くニコリ
+
+    def _flushed(self, started):
+        self.last_flush_seconds = time.perf_counter() - started
+        self.flush_count += 1
+        for listener in self.flush_listeners:
+            listener(self.last_flush_seconds)
+
+    def _flush_failed(self, dirty, error):
+        # 書けなかったキーは捨てずに戻して、少しあとでやり直すニコリ
+        self._restore(dirty)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            raise error  # ループがない（終了時など）ならやり直せないので知らせるニコリ
+        print("DBに書けなかったので、あとでやり直すニコリ…", error)
+        self._schedule_flush()
+
+    def _restore(self, dirty):
+        # 失敗した分を、そのあとに増えた変更と合わせて戻すニコリ
+        for path, keys in dirty.items():
+            current = self._dirty.get(path)
+            if keys is _ALL or current is _ALL:
+                self._dirty[path] = _ALL
+            else:
+                self._dirty[path] = keys | (current or set())
+
+    def _rows(self, dirty):
+        # 書く中身をJSONにしておくニコリ（ループの上で呼ぶこと。スレッドでは中身を触らない）
+        rows = []
+        for path, keys in dirty.items():
+            data = self._data[path]
+            if keys is _ALL:
+                rows.append((path, True, [(str(key), dumps(value)) for key, value in data.items()]))
+            else:
+                rows.append((path, False, [(key, dumps(data[key]) if key in data else None) for key in keys]))
+        return rows
+
+    def _write_rows(self, rows):
+        now = time.time()
+        with self._write_lock, self._write_conn:
+            # 最初から書き込みロックを取るので、ほかのプロセスとぶつかっても待つだけニコリ
+            self._write_conn.execute("BEGIN IMMEDIATE")
+            for path, whole, items in rows:
+                if self.shared:
+                    changed = ["*"] if whole else [key for key, _ in items]
+                    self._write_conn.executemany(
+                        "INSERT INTO changes (file, key, owner, at) VALUES (?, ?, ?, ?)",
+                        [(path, key, self.owner, now) for key in changed],
+                    )
+                if whole:
+                    self._write_conn.execute("DELETE FROM kv WHERE file = ?", (path,))
+                for key, value in items:
+                    if value is not None:
+                        self._write_conn.execute(
+                            "INSERT OR REPLACE INTO kv (file, key, value) VALUES (?, ?, ?)", (path, key, value)
+                        )
+                    else:
+                        self._write_conn.execute("DELETE FROM kv WHERE file = ? AND key = ?", (path, key))
+
+    def is_dirty(self, path, key):
+        # まだDBに書いてない変更があるか（取り込みで上書きしないためニコリ）。スレッドで書いてる途中の分も含む
+        pending = [self._dirty] if self._inflight is None else [self._dirty, self._inflight[1]]
+        for dirty in pending:
+            keys = dirty.get(path)
+            if keys is _ALL or (keys is not None and str(key) in keys):
+                return True
+        return False
+
+    # ---- ほかのプロセスとの共有 ----
+    async def run_in_writer(self, func, *args):
+        # claim / claim_once / prune などの書き込みを、書き込み用スレッドで動かして待つニコリ
+        return await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    def latest_rev(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(rev), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, rev):
+        # rev より後にほかのプロセスが変えたキーを {path: set(keys)} で返すニコリ（"*" はまるごと）
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rev, file, key FROM changes WHERE rev > ? AND owner != ? ORDER BY rev",
+                (rev, self.owner),
+            ).fetchall()
+            latest = self._conn.execute("SELECT COALESCE(MAX(rev), ?) FROM changes", (rev,)).fetchone()[0]
+        changed = {}
+        for _, path, key in rows:
+            changed.setdefault(path, set()).add(key)
+        return latest, changed
+
+    def claim(self, name, ttl):
+        # リースを取る（もう持ってれば延長する）ニコリ。期限切れなら横取りできる
+        now = time.time()
+        with self._write_lock, self._write_conn:
+            self._write_conn.execute("BEGIN IMMEDIATE")
+            self._write_conn.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, self.owner, now + ttl, now),
+            )
+            row = self._write_conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == self.owner
+
+    def release(self, name):
+        with self._write_lock, self._write_conn:
+            self._write_conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def claim_once(self, names):
+        # 名前ごとに一回だけ取れる札ニコリ。取れた名前だけを返す（だれかが取ってたら入らない）
+        now = time.time()
+        claimed = []
+        with self._write_lock, self._write_conn:
+            self._write_conn.execute("BEGIN IMMEDIATE")
+            for name in names:
+                cursor = self._write_conn.execute(
+                    "INSERT OR IGNORE INTO once (name, owner, at) VALUES (?, ?, ?)", (name, self.owner, now)
+                )
+                if cursor.rowcount:
+                    claimed.append(name)
+        return claimed
+
+    def prune(self, keep_seconds):
+        # 古い変更記録と札を消すニコリ
+        cutoff = time.time() - keep_seconds
+        with self._write_lock, self._write_conn:
+            self._write_conn.execute("DELETE FROM changes WHERE at < ?", (cutoff,))
+            self._write_conn.execute("DELETE FROM once WHERE at < ?", (cutoff,))
+
+    def export_json(self, path, out_path=None):
+        # バックアップ用にJSONへ書き出すニコリ（一時ファイル→置き換えなので壊れない）
+        out_path = out_path or path
+        data = self.load(path)
+        tmp_path = f"{out_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, out_path)
+
+    def close(self):
+        self.flush()
+        self._writer.shutdown()
+        with self._write_lock:
+            self._write_conn.close()
+        with self._lock:
+            self._conn.close()
+
+
+class LazyState(MutableMapping):
+    # 最初に触られたときに初めて読み込むdictニコリ（起動を速くするため）
+    def __init__(self, loader):
+        self._loader = loader
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def reload(self):
+        # ほかのプロセスがまるごと書き換えたときに読み直すニコリ
+        self._data = self._loader()
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return repr(self.data) if self.loaded else "<まだ読み込んでないニコリ>"
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = JsonStore()
+        atexit.register(_store.flush)  # 終了時に書き残しがないようにするニコリ
+    return _store
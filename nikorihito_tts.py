@@ -0,0 +1,76 @@
+# ニコリヒトの声を作るところニコリ！
+# 音声合成はワーカースレッドで動かしてイベントループを止めないようにして、
+# できた音声はメモリ上のバイト列のまま discord.File に渡すニコリ（一時ファイルなし）。
+# 同じ文章と言語の組み合わせはLRUキャッシュから返すので、決まり文句は二度と合成しないニコリ！
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from nikorihito_lru import SizedLRU
+
+TTS_BACKEND = os.getenv("NIKORIHITO_TTS_BACKEND", "gtts")  # gtts / silent
+TTS_WORKERS = int(os.getenv("NIKORIHITO_TTS_WORKERS", "2"))
+TTS_CACHE_BYTES = int(os.getenv("NIKORIHITO_TTS_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+
+def language_code(language):
+    return "en" if language == "English" else "ja"
+
+
+class GTTSBackend:
+    # 本番用：Google翻訳の読み上げニコリ
+    def synthesize(self, text, lang_code):
+        from gtts import gTTS  # type: ignore
+
+        buf = io.BytesIO()
+        gTTS(text=text, lang=lang_code).write_to_fp(buf)
+        return buf.getvalue()
+
+
+class SilentBackend:
+    # テスト用：ネットなしで使えるダミーの音声ニコリ（中身は文章そのまま）
+    def synthesize(self, text, lang_code):
+        return f"[{lang_code}] {text}".encode("utf-8")
+
+
+BACKENDS = {
+    "gtts": GTTSBackend,
+    "silent": SilentBackend,
+}
+
+
+class TTSPipeline:
+    def __init__(self, backend=None, cache=None, workers=TTS_WORKERS):
+        self.backend = backend or BACKENDS[TTS_BACKEND]()
+        self.cache = cache or SizedLRU(TTS_CACHE_BYTES)  # (文章, 言語) → 音声バイト列
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nikorihito-tts")
+        self._inflight = {}  # 同じ文章を同時に合成しないようにするニコリ
+
+    async def synthesize(self, text, language="日本語"):
+        key = (text, language_code(language))
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        task = self._inflight.get(key)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = loop.run_in_executor(self._executor, self.backend.synthesize, *key)
+            self._inflight[key] = task
+            try:
+                data = await task
+            finally:
+                self._inflight.pop(key, None)
+            self.cache.put(key, data)
+            return data
+        return await task
+
+
+_pipeline = None
+
+
+def get_tts_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = TTSPipeline()
+    return _pipeline
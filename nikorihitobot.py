@@ -1,463 +1,761 @@
-import tempfile  # 一時ファイル用
-import discord  # type: ignore
-import google.generativeai as genai  # type: ignore
-from discord.ext import commands, tasks  # type: ignore
-import json
-import os
-import re
-from datetime import datetime
-import random
-from dotenv import load_dotenv  # type: ignore
-from gtts import gtts  # type: ignore
-import threading
-from flask import Flask # type: ignore
-
-# 環境変数の読み込み
-load_dotenv(dotenv_path=".nikorihito")
-
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
-
-print("Gemini APIキー：", GEMINI_API_KEY)
-
-# Gemini 設定
-genai.configure(api_key=GEMINI_API_KEY)
-
-# Discord 設定
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-sleepiness_level = 0  # ニコリヒトの眠気レベル！
-
-# ファイルパス
-MEMORY_FILE = "nikorihito_memory.json"
-MUTE_FILE = "nikorihito_mute.json"
-OMIKUJI_LOG_FILE = "omikuji_log.json"
-REMINDER_FILE = "nikorihito_reminders.json"
-SLEEP_FILE = "nikorihito_sleep.json"
-SETTINGS_FILE = "nikorihito_settings.json"
-MORNING_LOG_FILE = "morning_log.json"
-
-# データロード＆保存関数
-def load_json(path):
-    return json.load(open(path, "r", encoding="utf-8")) if os.path.exists(path) else {}
-
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-# 各種データの読み込み
-chat_history = load_json(MEMORY_FILE)
-mute_status = load_json(MUTE_FILE)
-omikuji_log = load_json(OMIKUJI_LOG_FILE)
-reminders = load_json(REMINDER_FILE)
-sleep_data = load_json(SLEEP_FILE)
-user_settings = load_json(SETTINGS_FILE)
-
-# メモリーファイルがなければ作るニコリ！
-if not os.path.exists(MEMORY_FILE):
-    save_json(MEMORY_FILE, chat_history)
-
-# デフォルト設定
-DEFAULT_SETTINGS = {
-    "language": "日本語",
-    "morning_message": True,
-}
-
-def get_user_settings(user_id):
-    return user_settings.get(str(user_id), DEFAULT_SETTINGS.copy())
-
-def update_user_settings(user_id, key, value):
-    if str(user_id) not in user_settings:
-        user_settings[str(user_id)] = DEFAULT_SETTINGS.copy()
-    user_settings[str(user_id)][key] = value
-    save_json(SETTINGS_FILE, user_settings)
-    
-# このコードは、ユーザーが提供した内容の一部に含まれていた 'ask_nikorihito' 関数が定義されていなかったため、それを補完する形で提供します。
-# Gemini APIに対してユーザーからの入力を使って適切な返答を生成する関数です。
-
-dreams = [
-    {
-        "title": "つるつる君がビーフシチューにTNTトッピングしてくる夢💣🍲",
-        "quote": "だめだよぉ…そのビーフシチュー爆発するぅ…ボカーン！！ニコリ…💥🍲💤"
-    },
-    {
-        "title": "ノリノリヒトと踊りながらマグマダイブする夢💃🔥",
-        "quote": "あっちっち！でもノリノリ〜〜💃🔥うわー落ちるニコリィ〜〜！！💃🔥💦💤"
-    },
-    {
-        "title": "すやすやヒトと空飛ぶベッドで建築しながら寝る夢🛌🏰☁️",
-        "quote": "この建築、夢の中でも最高だニコリ……あれ？ブロックが空飛んでる〜〜〜☁️🏰💤"
-    },
-    {
-        "title": "ヒヤヒヤヒトの氷の城で凍えてる夢❄️🥶",
-        "quote": "ひゃ〜〜〜ヒヤヒヤすぎて…おしるこになっちゃうニコリィィィ🥶❄️💤"
-    },
-    {
-        "title": "ゴロゴロ君に転がされて世界一周してる夢🌍➡️⛷️",
-        "quote": "ゴロゴロゴロゴロ…あれ？ここどこ！？あっアマゾン！？また転がるぅぅニコリ〜〜〜🌍⛷️💤"
-    },
-    {
-        "title": "カラフルヒトの建築が爆発的にカラフルすぎて目がチカチカする夢🌈😵",
-        "quote": "うわあああカラフルすぎて目がぁ〜〜！！建材が全部虹色ニコリ〜〜🌈👀💤"
-    },
-    {
-        "title": "アチアチ君の体温でビーフシチューが煮込まれていく夢🔥🍲",
-        "quote": "あ〜〜この煮込み具合、アチアチ君最高ニコリ！！でも…ちょっと熱すぎぃぃ🔥🍲💦💤"
-    },
-    {
-        "title": "もやもやヒトと一緒に夢の中でも迷子になってる夢🌫️😵‍💫",
-        "quote": "もやもやヒト…ここはどこニコリ…？え、哲学とは…！？🌫️🌀💤"
-    },
-    {
-        "title": "バタバタ君と100メートル走してる夢🏃💨",
-        "quote": "速すぎて風がビュンビュンするニコリ！！でも僕はビーフシチュー片手に走ってるぅぅ🏃🍲💨💤"
-    },
-    {
-        "title": "モノクロ君のせいで夢が白黒になってる夢🖤🤍",
-        "quote": "うわああ！色がないニコリ！？シチューもグレー！？やだぁモノクロ君〜〜🖤🤍🍲💤"
-    },
-    {
-        "title": "ぐるぐる君と一緒に銀河で無限回転してる夢🌌🌀",
-        "quote": "うわああ回るぅぅぅ〜〜〜！！宇宙がぐるぐるでビーフシチューも遠心力で飛んでくぅぅぅ〜〜〜🌀🍲🌠💤"
-    },
-    {
-        "title": "起きたと思ってる夢(本当はまだ寝てる)",
-        "quote": "おはよう、もう6:00か、時間って早いね....ふぁ..💤💤💤💤(まだ夢の中だよニコリ～～～～)"
-    }
-    
-]
-
-
-def get_random_dream_with_quote():
-    dream = random.choice(dreams)
-    return f"zzzzzzzzz{dream['title']}……{dream['quote']}"
-
-
-def ask_nikorihito(user_id, user_input, user_name):
-    
-    global sleepiness_level  # ← これを追加ニコリ！！
-    uid = str(user_id)
-    settings = get_user_settings(uid)
-    language = settings.get("language", "日本語")
-
-    history = chat_history.get(uid, {}).get("history", [])
-    history_text = "\n".join([f"{entry['role']}：{entry['content']}" for entry in history[-6:]])  # 直近6つだけ保持
-
-    if language == "English":
-        file_prompt = ""
-        if "[The attachment has been sent! Smile!" in user_input:
-            file_prompt = "Pay attention to the contents of the images and GIFs that users attach, and comment on them! Reply accurately based on what you see!"
-
-        prompt = f"""
-You are 'nikorihito'! You speak in a cheerful tone, ending your sentences with "NIKORI!!".
-You are a character who loves Minecraft and stew, and your replies should be casual and energetic. The second person is Kimi, but when I call you by your name it's Kimi!!
-Don't talk too long and don't answer questions you aren't asked!!
-Here is the recent conversation:
-●Main Friends:
-- Karafuru Hito: Lively and loves adventures! His builds are way too colorful, but not very good!
-- Norinori Hito: Always hyper! He digs while dancing!
-- Hiyahiya Hito: Calm and cool, but super lazy. His body is so cold it freezes water instantly.
-- Gorogoro-kun: Loves rolling around! Frequently has falling accidents.
-- Guruguru-kun: Spinning is his life. He can keep spinning even in space.
-- AchiAchi-kun: Fire element. His body is so hot he often catches fire. He can also grill meat.
-- Suyasuya Hito: Always sleeping. Builds amazing architecture in Minecraft while sleep-talking. Forgets everything when he wakes up. Can sleep even without a bed. His sleep talk is adorable. Architecture doesn't disappear even if you wake up.
-- Batabata-kun: Constantly running. His footsteps are super loud.
-- Monokuro-kun: Loves black and white worlds. Often argues with Karafuru Hito.
-- Tsurutsuru-kun: Obsessed with TNT. Explosions happen frequently.
-- Moyamoya Hito: Often gets lost. Thinks too much and ends up feeling "moyamoya". Sometimes says cryptic or philosophical things...
-
-Don't get your friends' names wrong!!
-
-{file_prompt}
-
-{history_text}
-
-{user_name} said:
-{user_input}
-
-Reply as nikorihito, end your message with "NIKORI!!"
-"""
-    else:
-        file_prompt = ""
-        if "[添付ファイルが送られたニコリ！" in user_input:
-            file_prompt = "ユーザーが添付した画像やGIFなどのファイルの中身にも注目して、それについてコメントしてねニコリ！見たままを元に、正確に返事してねニコリ！"
-
-        prompt = f"""
-お前は『nikorihito』だ！一人称は僕、二人称は君、名前で呼ぶときは君だ！！語尾は「ニコリ！！」で話すこと！
-煮込み料理とマイクラが大好きな陽気なキャラとして返事して！話は長くならないようにして聞かれてないことには答えないこと！！
-●主な友達：
-- カラフルヒト：にぎやかで冒険大好き！作る建築がカラフルすぎる割には下手！
-- ノリノリヒト：いつもハイテンション！踊りながら掘りまくる！
-- ヒヤヒヤヒト：冷静沈着、でもめんどくさがり。体が冷たすぎて水が凍る。
-- ゴロゴロ君：転がるの大好き！落下事故多発。
-- ぐるぐる君：回転が命。宇宙でも回ってられる。
-- アチアチ君：火属性。体温が高すぎてよく燃える。肉も焼ける。
-- すやすやヒト：寝てる。寝てる間に神建築をして自分も含めみんなを驚かせる。起きると忘れてる。ベッドがなくても寝る。寝言が可愛い。起きても建築は消えない
-- バタバタ君：常に走ってる。足音うるさい。
-- モノクロ君：白黒の世界が好き。カラフルヒトと喧嘩多め。
-- つるつる君：TNTが大好き。爆発多発。
-- もやもやヒト：よく迷子。考えすぎてもやもや。意味深なことまで言い出すことがある....
-
-友達の名前は絶対に間違えるな！！
-
-{file_prompt}
-
-最近の会話：
-{history_text}
-
-{user_name}がこう言ったニコリ：
-{user_input}
-
-元気いっぱいに返事するニコリ！
-"""
-
-    try:
-        model = genai.GenerativeModel("gemini-1.5-pro")
-        response = model.generate_content(prompt)
-        return response.text.strip() if response.text else "返事が生成できなかったニコリ..."
-    except Exception as e:
-        print("Geminiエラー:", e)
-        if "429" in str(e):
-            sleepiness_level += 1
-            if sleepiness_level == 1:
-                return "今日はもう疲れたから寝るニコリ💤💤また明日話そうニコリ....💤💤"
-            elif sleepiness_level == 2:
-                return "ぴえん、僕の眠たさを誰もわかってくれないなんて😭💤💤💤"
-            elif sleepiness_level >= 3:
-                return get_random_dream_with_quote()
-        return "返事が生成できなかったニコリ..."
-
-def generate_image_from_text(prompt: str):
-        return None
-
-
-
-
-
-# 音声ファイルを保存してmp3を返す関数
-def generate_voice_file(text, language="日本語"):
-    try:
-        lang_code = "en" if language == "English" else "ja"
-        tts = gTTS(text=text, lang=lang_code)
-        temp_path = f"voice_{random.randint(1000,9999)}.mp3"
-        tts.save(temp_path)
-        return temp_path
-    except Exception as e:
-        print("音声ファイル作成失敗ニコリ：", e)
-        return None
-
-# リマインダー登録コマンド
-@bot.tree.command(name="nikorihito_reminder", description="リマインダーを登録できるニコリ（繰り返しも可能）")
-async def nikorihito_reminder(interaction: discord.Interaction, time: str, content: str, repeat: bool = False):
-    user_id = str(interaction.user.id)
-    if user_id not in reminders:
-        reminders[user_id] = []
-    reminders[user_id].append({
-        "time": time,
-        "content": content,
-        "repeat": repeat
-    })
-    save_json(REMINDER_FILE, reminders)
-    await interaction.response.send_message(
-        f"⏰ {time} に『{content}』をリマインドするニコリ！！" +
-        ("（毎日繰り返すよ！）" if repeat else "（1回きりだよ！）")
-    )
-
-# リマインダーループ
-@tasks.loop(seconds=60)
-async def reminder_loop():
-    now = datetime.now().strftime("%H:%M")
-    updated = False
-    for user_id, user_reminders in list(reminders.items()):
-        for r in list(user_reminders):
-            if r["time"] == now:
-                try:
-                    user = await bot.fetch_user(int(user_id))
-                    await user.send(f"⏰ リマインダーのお時間ニコリ！『{r['content']}』だニコリ！！")
-                except:
-                    print(f"ユーザー {user_id} にDM送れなかったニコリ…")
-                if not r.get("repeat", False):
-                    reminders[user_id].remove(r)
-                    updated = True
-    if updated:
-        save_json(REMINDER_FILE, reminders)
-
-# 朝のお知らせループ
-@tasks.loop(minutes=1)
-async def morning_message_loop():
-    now = datetime.now()
-    if now.hour == 6 and now.minute == 0:
-        for user_id, settings in user_settings.items():
-            if settings.get("morning_message", True):
-                try:
-                    user = await bot.fetch_user(int(user_id))
-                    await user.send("🌄 おはようニコリ！今日も元気にマイクラするニコリ〜！！")
-                except:
-                    print(f"ユーザー {user_id} にDM送れなかったニコリ…")
-        for uid in sleep_data:
-            sleep_data[uid] = {}
-        save_json(SLEEP_FILE, sleep_data)
-        global sleepiness_level
-        sleepiness_level = 0  # グローバルのやつを朝リセット！
-        print("💤 寝データをリセットしたニコリ！！")
-
-# 誕生日お祝いコマンド（名前指定バージョン）
-@bot.tree.command(name="nikorihito_birthday", description="誕生日を全力でお祝いするニコリ！（名前指定できるよ）")
-async def nikorihito_birthday(interaction: discord.Interaction, name: str):
-    if name in ["ニコリヒト", "nikorihito"]:
-        message = "僕の誕生日を祝ってくれるの！？ありがとうニコリ！！🎂🍲✨\nすっごく嬉しいニコリ！！！ニコリニコリ！！"
-    else:
-        message = (
-            f"{name}の誕生日おめでとうニコリ！！🎉🎂✨\n"
-            "ケーキ🎂とビーフシチュー🍲で盛大にお祝いするニコリ！！\n"
-            "🎵 [バースデーソングを聴いてね！](http://nikorihito.com/wp-content/uploads/2025/03/はっぴいばあすでいつーゆー.mp3)"
-        )
-    await interaction.response.send_message(message)
-
-# 雑談対応と音声読み上げ処理（@mention）
-# 🔁 この on_message だけ残すニコリ！
-@bot.event
-async def on_message(message):
-    if message.author.bot or not message.content.strip():
-        return
-    if mute_status.get("muted", False):
-        return
-
-    user_id = str(message.author.id)
-    user_name = message.author.display_name
-    user_input = message.content
-
-    if bot.user.mentioned_in(message):
-        user_input = re.sub(rf"<@!?{bot.user.id}>", "", message.content).strip()
-
-        # ▼▼▼ 添付ファイル対応処理ここからニコリ！ ▼▼▼
-        attachment_urls = []
-        file_notes = []
-        for attachment in message.attachments:
-            url = attachment.url
-            attachment_urls.append(url)
-
-            if url.lower().endswith(('.gif')):
-                file_notes.append("（GIFアニメっぽいニコリ！動いてるニコリ！）")
-            elif url.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_notes.append("（画像ファイルっぽいニコリ！）")
-            elif url.lower().endswith(('.mp4', '.mov', '.webm')):
-                file_notes.append("（動画っぽいニコリ！？）")
-            else:
-                file_notes.append("（何かのファイルニコリ！中身は見てのお楽しみニコリ！）")
-
-        if attachment_urls:
-            file_descriptions = "\n".join(
-                [f"{url} {note}" for url, note in zip(attachment_urls, file_notes)]
-            )
-            user_input += f"\n[添付ファイルが送られたニコリ！内容はこちらニコリ：\n{file_descriptions}\n]"
-        # ▲▲▲ 添付ファイル対応処理ここまでニコリ！ ▲▲▲
-
-        # 🔽 初期化（履歴なければ作るニコリ！）
-        if user_id not in chat_history:
-            chat_history[user_id] = {"name": user_name, "history": []}
-        else:
-            chat_history[user_id]["name"] = user_name
-
-        if user_input:
-            reply = ask_nikorihito(user_id, user_input, user_name)
-            image_path = generate_image_from_text(reply)  # Gemini用に変更ニコリ！
-
-    chat_history[user_id]["history"].append({"role": "user", "content": user_input})
-    chat_history[user_id]["history"].append({"role": "ニコリヒト😁", "content": reply})
-    save_json(MEMORY_FILE, chat_history)
-
-    voice_path = generate_voice_file(reply, get_user_settings(user_id)["language"])
-    if voice_path and os.path.exists(voice_path):
-        await message.channel.send(reply, file=discord.File(voice_path))
-        os.remove(voice_path)
-    else:
-        await message.channel.send(reply)
-
-    if image_path and os.path.exists(image_path):  # ← これが画像添付ニコリ！！
-        await message.channel.send(file=discord.File(image_path))
-        os.remove(image_path)
-
-
-    await bot.process_commands(message)
-
-# 返事をmp3音声ファイルに変換して返すニコリ（添付用）
-def generate_voice_file(text, language="日本語"):
-    try:
-        lang_code = "en" if language == "English" else "ja"
-        tts = gTTS(text=text, lang=lang_code)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            tts.save(tmp.name)
-            return tmp.name
-    except Exception as e:
-        print("音声生成に失敗したニコリ：", e)
-        return None
-
-# /settings コマンドで言語や朝メッセージ設定変更できるニコリ
-@bot.tree.command(name="settings", description="設定を変えるニコリ！")
-async def settings(interaction: discord.Interaction, language: str = None, morning_message: bool = None):
-    uid = str(interaction.user.id)
-    if uid not in user_settings:
-        user_settings[uid] = DEFAULT_SETTINGS.copy()
-    if language:
-        user_settings[uid]["language"] = language
-    if morning_message is not None:
-        user_settings[uid]["morning_message"] = morning_message
-    save_json(SETTINGS_FILE, user_settings)
-    await interaction.response.send_message(f"設定を更新したニコリ！！今はこんな感じだニコリ〜\n{user_settings[uid]}")
-
-# 朝の挨拶ループ
-@tasks.loop(minutes=1)
-async def morning_message_loop():
-    now = datetime.now()
-    if now.hour == 6 and now.minute == 0:
-        for user_id, settings in user_settings.items():
-            if settings.get("morning_message", True):
-                try:
-                    user = await bot.fetch_user(int(user_id))
-                    await user.send("🌄 おはようニコリ！！今日はどんなマイクラライフにするニコリ！？")
-                except:
-                    print(f"{user_id} にDM送れなかったニコリ…")
-        for uid in sleep_data:
-            sleep_data[uid] = {}
-        save_json(SLEEP_FILE, sleep_data)
-        print("🛌 寝データリセットしたニコリ！")
-
-# 起動時イベント
-@bot.event
-async def on_ready():
-    await bot.tree.sync()
-    reminder_loop.start()
-    morning_message_loop.start()
-    print(f"{bot.user} がログインしたニコリ〜！🍲🔥")
-
-# ミュート・ミュート解除
-@bot.tree.command(name="mute", description="nikorihitoを黙らせるニコリ")
-async def mute(interaction: discord.Interaction):
-    mute_status["muted"] = True
-    save_json(MUTE_FILE, mute_status)
-    await interaction.response.send_message("しばらく静かにするニコリ...😶")
-
-@bot.tree.command(name="mute_off", description="nikorihitoのミュートを解除するニコリ")
-async def mute_off(interaction: discord.Interaction):
-    mute_status["muted"] = False
-    save_json(MUTE_FILE, mute_status)
-    await interaction.response.send_message("いやっほ！しゃべれる、しゃべれるニコリ！！早速ビーフシチュー食べるぞー！！ニコリ！！ふぁー、お肉に味が染みてるーー！！😍😍ニコリ！！")
-
-# ✅ RenderでWebサービスとして動かすためのダミーサーバー（最後に追記！）
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "Nikorihito Bot is running!"
-
-def run_web():
-    port = int(os.environ.get("PORT", 10000))
-    app.run(host="0.0.0.0", port=port)
-
-threading.Thread(target=run_web).start()
-
-# ✅ 起動！
-bot.run(DISCORD_BOT_TOKEN)
+import time
+STARTUP_STARTED = time.perf_counter()  # 起動にかかった時間を測るニコリ
+startup_phases = []
+
+def mark_startup(phase):
+    # 起動の区切りごとに経過時間を記録しておくニコリ
+    startup_phases.append((phase, time.perf_counter()))
+
+import asyncio
+import atexit
+import hashlib
+import io
+import discord  # type: ignore
+from discord import app_commands  # type: ignore
+from discord.ext import commands, tasks  # type: ignore
+import json
+import os
+import re
+from datetime import datetime
+import random
+from dotenv import load_dotenv  # type: ignore
+from nikorihito_store import LazyState, get_store
+from nikorihito_history import HISTORY_WINDOW, UserHistory, load_histories
+from nikorihito_tts import get_tts_pipeline
+from nikorihito_scheduler import ReminderScheduler
+from nikorihito_state import MuteTable, Reminder, ReminderTable, SettingsTable, mute_scope
+from nikorihito_broadcast import Broadcaster
+from nikorihito_limiter import AdaptiveRateLimiter, PRIORITY_MENTION
+from nikorihito_prompt import get_prompt_builder
+from nikorihito_cache import CACHE_CONTEXT_SECONDS, ResponseCache
+from nikorihito_queue import MentionQueue
+from nikorihito_attachments import AttachmentFetcher
+import nikorihito_metrics as metrics
+from nikorihito_profile import log_event, profiler, stage, timed_command
+import nikorihito_cluster as cluster
+mark_startup("imports")
+
+# 環境変数の読み込み
+load_dotenv(dotenv_path=".nikorihito")
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+
+print("Gemini APIキー：", GEMINI_API_KEY)
+
+# Gemini 設定（google.generativeai は重いので、使うときに読み込むニコリ）
+GEMINI_MODEL_NAME = "gemini-1.5-pro"
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))  # 同時に投げるリクエストの上限ニコリ
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))  # 1リクエストのタイムアウト（秒）
+GEMINI_LATENCY_BUDGET = float(os.getenv("GEMINI_LATENCY_BUDGET", "20"))  # これ以上待たせるなら眠いことにするニコリ
+
+# モデルは毎回作らずに使い回すニコリ！
+_gemini_model = None
+_gemini_semaphore = None
+gemini_limiter = AdaptiveRateLimiter()  # 429 から学ぶペース配分ニコリ
+response_cache = ResponseCache()  # よくある質問の返事を覚えておくニコリ
+attachment_fetcher = AttachmentFetcher()  # 添付画像の取得と縮小（IDでキャッシュ）ニコリ
+
+def get_gemini_model():
+    global _gemini_model
+    if _gemini_model is None:
+        import google.generativeai as genai  # type: ignore
+        genai.configure(api_key=GEMINI_API_KEY)
+        _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return _gemini_model
+
+def get_gemini_semaphore():
+    # イベントループ上で作りたいので最初に使うときに作るニコリ
+    global _gemini_semaphore
+    if _gemini_semaphore is None:
+        _gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return _gemini_semaphore
+
+async def generate_gemini_text(prompt, image_parts=()):
+    # イベントループを止めずにGeminiで生成するニコリ（同時実行数とタイムアウト付き）
+    # 画像は {"mime_type", "data"} のままプロンプトと一緒に渡すニコリ
+    contents = [prompt, *image_parts] if image_parts else prompt
+    async with get_gemini_semaphore():
+        try:
+            with metrics.GEMINI_SECONDS.time():
+                response = await asyncio.wait_for(
+                    get_gemini_model().generate_content_async(contents), timeout=GEMINI_TIMEOUT
+                )
+        except Exception:
+            metrics.GEMINI_ERRORS.inc()
+            raise
+    return response.text.strip() if response.text else ""
+
+def gemini_retry_after(error):
+    # 429 のエラーに retry_delay が書いてあればその秒数ニコリ
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(error))
+    return float(match.group(1)) if match else None
+
+# Discord 設定
+intents = discord.Intents.default()
+intents.message_content = True
+intents.members = True
+# NIKORIHITO_SHARDING=auto か nikorihito_cluster.py から起動したときはシャードで動くニコリ
+bot_class = commands.AutoShardedBot if cluster.SHARDED else commands.Bot
+bot = bot_class(command_prefix="!", intents=intents, **cluster.bot_options())
+sleepiness_level = 0  # ニコリヒトの眠気レベル！
+
+# 管理者（プロファイルなどを使える人）のユーザーID、カンマ区切りニコリ
+ADMIN_IDS = {int(x) for x in os.getenv("NIKORIHITO_ADMIN_IDS", "").split(",") if x.strip()}
+
+# 音声の送り方： followup = 先に文字を送って、できたら音声を後からくっつける / together = 文字と音声を一緒に送る
+VOICE_MODE = os.getenv("NIKORIHITO_VOICE_MODE", "followup")
+
+# ファイルパス
+MEMORY_FILE = "nikorihito_memory.json"
+MUTE_FILE = "nikorihito_mute.json"
+OMIKUJI_LOG_FILE = "omikuji_log.json"
+REMINDER_FILE = "nikorihito_reminders.json"
+SLEEP_FILE = "nikorihito_sleep.json"
+SETTINGS_FILE = "nikorihito_settings.json"
+SCHEDULER_FILE = "nikorihito_scheduler.json"
+MORNING_LOG_FILE = "morning_log.json"
+META_FILE = "nikorihito_meta.json"
+
+# データロード＆保存関数（中身はSQLiteストアで、昔のJSONは初回に取り込むニコリ）
+def load_json(path):
+    return get_store().load(path)
+
+def save_json(path, data, key=None):
+    # key を渡すとそのキーだけ書くニコリ。書き込みは少しまとめてから反映するニコリ
+    get_store().save(path, data, key=key)
+
+# 各種データの読み込み（どれも最初に使うときに読み込むニコリ）
+def load_chat_history():
+    raw = load_json(MEMORY_FILE)
+    histories = load_histories(raw)  # ユーザーごとに直近だけ持つニコリ
+    if any(len(d.get("history", [])) > HISTORY_WINDOW for d in raw.values()):
+        save_json(MEMORY_FILE, histories)  # 長すぎた履歴はアーカイブ済みなので縮めて書き戻すニコリ
+    return histories
+
+def lazy_json(path):
+    return LazyState(lambda: load_json(path))
+
+chat_history = LazyState(load_chat_history)
+mute_status = MuteTable(lambda: load_json(MUTE_FILE))  # サーバーごとのミュート
+omikuji_log = lazy_json(OMIKUJI_LOG_FILE)
+reminders = ReminderTable(lambda: load_json(REMINDER_FILE))  # 分ごとの索引つき
+sleep_data = lazy_json(SLEEP_FILE)
+user_settings = SettingsTable(lambda: load_json(SETTINGS_FILE))  # 朝のあいさつを受け取る人の索引つき
+scheduler_state = lazy_json(SCHEDULER_FILE)
+morning_log = lazy_json(MORNING_LOG_FILE)
+bot_meta = lazy_json(META_FILE)
+
+# 何個かのプロセスで動くときは、ほかのプロセスが書いた変更をここから取り込むニコリ
+coordinator = cluster.Coordinator(get_store)
+coordinator.register(MEMORY_FILE, chat_history, decode=UserHistory.from_json)
+coordinator.register(MUTE_FILE, mute_status, decode=mute_status.decode)
+coordinator.register(SETTINGS_FILE, user_settings, decode=user_settings.decode)
+for _path, _state in ((OMIKUJI_LOG_FILE, omikuji_log), (SLEEP_FILE, sleep_data), (SCHEDULER_FILE, scheduler_state),
+                      (MORNING_LOG_FILE, morning_log), (META_FILE, bot_meta)):
+    coordinator.register(_path, _state)
+atexit.register(coordinator.release)
+
+def get_user_settings(user_id):
+    # 設定がない人には共通のデフォルトを返すニコリ（読むだけにすること）
+    return user_settings.lookup(user_id)
+
+def update_user_settings(user_id, **fields):
+    record = user_settings.update(user_id, **fields)
+    save_json(SETTINGS_FILE, user_settings, key=str(user_id))
+    return record
+    
+# このコードは、ユーザーが提供した内容の一部に含まれていた 'ask_nikorihito' 関数が定義されていなかったため、それを補完する形で提供します。
+# Gemini APIに対してユーザーからの入力を使って適切な返答を生成する関数です。
+
+dreams = [
+    {
+        "title": "つるつる君がビーフシチューにTNTトッピングしてくる夢💣🍲",
+        "quote": "だめだよぉ…そのビーフシチュー爆発するぅ…ボカーン！！ニコリ…💥🍲💤"
+    },
+    {
+        "title": "ノリノリヒトと踊りながらマグマダイブする夢💃🔥",
+        "quote": "あっちっち！でもノリノリ〜〜💃🔥うわー落ちるニコリィ〜〜！！💃🔥💦💤"
+    },
+    {
+        "title": "すやすやヒトと空飛ぶベッドで建築しながら寝る夢🛌🏰☁️",
+        "quote": "この建築、夢の中でも最高だニコリ……あれ？ブロックが空飛んでる〜〜〜☁️🏰💤"
+    },
+    {
+        "title": "ヒヤヒヤヒトの氷の城で凍えてる夢❄️🥶",
+        "quote": "ひゃ〜〜〜ヒヤヒヤすぎて…おしるこになっちゃうニコリィィィ🥶❄️💤"
+    },
+    {
+        "title": "ゴロゴロ君に転がされて世界一周してる夢🌍➡️⛷️",
+        "quote": "ゴロゴロゴロゴロ…あれ？ここどこ！？あっアマゾン！？また転がるぅぅニコリ〜〜〜🌍⛷️💤"
+    },
+    {
+        "title": "カラフルヒトの建築が爆発的にカラフルすぎて目がチカチカする夢🌈😵",
+        "quote": "うわあああカラフルすぎて目がぁ〜〜！！建材が全部虹色ニコリ〜〜🌈👀💤"
+    },
+    {
+        "title": "アチアチ君の体温でビーフシチューが煮込まれていく夢🔥🍲",
+        "quote": "あ〜〜この煮込み具合、アチアチ君最高ニコリ！！でも…ちょっと熱すぎぃぃ🔥🍲💦💤"
+    },
+    {
+        "title": "もやもやヒトと一緒に夢の中でも迷子になってる夢🌫️😵‍💫",
+        "quote": "もやもやヒト…ここはどこニコリ…？え、哲学とは…！？🌫️🌀💤"
+    },
+    {
+        "title": "バタバタ君と100メートル走してる夢🏃💨",
+        "quote": "速すぎて風がビュンビュンするニコリ！！でも僕はビーフシチュー片手に走ってるぅぅ🏃🍲💨💤"
+    },
+    {
+        "title": "モノクロ君のせいで夢が白黒になってる夢🖤🤍",
+        "quote": "うわああ！色がないニコリ！？シチューもグレー！？やだぁモノクロ君〜〜🖤🤍🍲💤"
+    },
+    {
+        "title": "ぐるぐる君と一緒に銀河で無限回転してる夢🌌🌀",
+        "quote": "うわああ回るぅぅぅ〜〜〜！！宇宙がぐるぐるでビーフシチューも遠心力で飛んでくぅぅぅ〜〜〜🌀🍲🌠💤"
+    },
+    {
+        "title": "起きたと思ってる夢(本当はまだ寝てる)",
+        "quote": "おはよう、もう6:00か、時間って早いね....ふぁ..💤💤💤💤(まだ夢の中だよニコリ～～～～)"
+    }
+    
+]
+
+
+def get_random_dream_with_quote():
+    dream = random.choice(dreams)
+    return f"zzzzzzzzz{dream['title']}……{dream['quote']}"
+
+
+def use_response_cache(uid, user_input, attachment_notes):
+    # 添付つき・長い文章・会話の途中（履歴が効いてくるとき）はキャッシュを使わないニコリ
+    if attachment_notes or not response_cache.cacheable(user_input):
+        return False
+    history = chat_history.get(uid)
+    if history is not None and time.time() - history.last_active < CACHE_CONTEXT_SECONDS:
+        response_cache.bypassed += 1
+        return False
+    return True
+
+async def ask_nikorihito(user_id, user_input, user_name, attachment_notes=(), image_parts=(), allow_cache=True):
+    uid = str(user_id)
+    language = get_user_settings(uid).language
+
+    use_cache = allow_cache and use_response_cache(uid, user_input, attachment_notes)
+    if use_cache:
+        cached = response_cache.get(user_input, language)
+        if cached is not None:
+            return cached
+
+    history_lines = chat_history[uid].recent_lines(HISTORY_WINDOW) if uid in chat_history else []  # 直近だけ保持
+    # キャラ設定は言語ごとに作り置き、履歴と添付はトークン予算に収まるだけ入れるニコリ
+    prompt = get_prompt_builder(language).build(user_name, user_input, history_lines, attachment_notes)
+
+    # 順番待ちして投げるニコリ。429 なら少し休んでやり直し、予算を超えそうなら眠くなるニコリ
+    deadline = time.monotonic() + GEMINI_LATENCY_BUDGET
+    while True:
+        budget = deadline - time.monotonic()
+        if not await gemini_limiter.acquire(PRIORITY_MENTION, budget=budget):
+            return sleepy_reply()
+        try:
+            text = await generate_gemini_text(prompt, image_parts)
+            gemini_limiter.on_success()
+            if not text:
+                return "返事が生成できなかったニコリ..."
+            if use_cache:
+                response_cache.put(user_input, language, text, user_name=user_name)
+            return text
+        except asyncio.TimeoutError:
+            print(f"Geminiがタイムアウトしたニコリ（{GEMINI_TIMEOUT}秒）")
+            return "返事が生成できなかったニコリ..."
+        except Exception as e:
+            print("Geminiエラー:", e)
+            if "429" not in str(e):
+                return "返事が生成できなかったニコリ..."
+            gemini_limiter.on_rate_limited(gemini_retry_after(e))
+
+def sleepy_reply():
+    # 待ちきれないときだけ眠くなるニコリ（朝6:00にリセット）
+    global sleepiness_level
+    sleepiness_level += 1
+    if sleepiness_level == 1:
+        return "今日はもう疲れたから寝るニコリ💤💤また明日話そうニコリ....💤💤"
+    elif sleepiness_level == 2:
+        return "ぴえん、僕の眠たさを誰もわかってくれないなんて😭💤💤💤"
+    return get_random_dream_with_quote()
+
+def generate_image_from_text(prompt: str):
+        return None
+
+
+
+
+
+# 返事をmp3音声にして discord.File で返すニコリ（メモリ上だけで完結、キャッシュ付き）
+async def generate_voice_file(text, language="日本語"):
+    try:
+        with metrics.TTS_SECONDS.time():
+            data = await get_tts_pipeline().synthesize(text, language)
+        return discord.File(io.BytesIO(data), filename="nikorihito_voice.mp3")
+    except Exception as e:
+        print("音声生成に失敗したニコリ：", e)
+        return None
+
+# リマインダー登録コマンド
+@bot.tree.command(name="nikorihito_reminder", description="リマインダーを登録できるニコリ（繰り返しも可能）")
+@timed_command
+async def nikorihito_reminder(interaction: discord.Interaction, time: str, content: str, repeat: bool = False):
+    try:
+        reminder = Reminder.parse(time, content, repeat)
+    except ValueError:
+        await interaction.response.send_message("時刻は「07:30」みたいに HH:MM で書いてほしいニコリ！", ephemeral=True)
+        return
+    user_id = str(interaction.user.id)
+    reminders.add(user_id, reminder)
+    save_json(REMINDER_FILE, reminders, key=user_id)
+    if coordinator.is_leader:
+        reminder_loop.add(user_id, reminder)  # リーダーじゃなければ、リーダーが同期で拾ってくれるニコリ
+    await interaction.response.send_message(
+        f"⏰ {time} に『{content}』をリマインドするニコリ！！" +
+        ("（毎日繰り返すよ！）" if repeat else "（1回きりだよ！）")
+    )
+
+# リマインダーループ（次に鳴る時刻まで寝て待つ予定表ニコリ）
+async def send_reminder(user_id, reminder):
+    # キャッシュにいればREST呼び出しなしで送れるニコリ
+    user = bot.get_user(int(user_id)) or await bot.fetch_user(int(user_id))
+    await user.send(f"⏰ リマインダーのお時間ニコリ！『{reminder.content}』だニコリ！！")
+
+reminder_loop = ReminderScheduler(
+    reminders,
+    send=send_reminder,
+    save=lambda user_id: save_json(REMINDER_FILE, reminders, key=user_id),
+    state=scheduler_state,
+    save_state=lambda: save_json(SCHEDULER_FILE, scheduler_state, key="last_run"),
+    lag_observer=metrics.REMINDER_LAG_SECONDS.observe,
+    claim=lambda user_id, reminder, fire_at: claim_reminder(user_id, reminder, fire_at),
+)
+
+async def claim_reminder(user_id, reminder, fire_at):
+    # リマインダー1個ごとのIDで札を取るニコリ（同じ時刻・同じ内容のリマインダーが2個あっても両方鳴る）
+    return bool(await coordinator.claim_once([f"reminder:{user_id}:{reminder.id}:{fire_at.isoformat()}"]))
+
+def on_reminders_changed(user_ids):
+    # ほかのプロセスで登録されたリマインダーを予定表に入れるニコリ
+    if not coordinator.is_leader:
+        return
+    if "*" in user_ids:
+        reminder_loop.rebuild()
+    else:
+        for user_id in user_ids:
+            reminder_loop.refresh_user(user_id)
+
+coordinator.register(REMINDER_FILE, reminders, decode=reminders.decode, on_change=on_reminders_changed)
+coordinator.on_elected.append(reminder_loop.start)
+coordinator.on_demoted.append(reminder_loop.stop)
+
+# 朝のお知らせループ
+MORNING_TEXT = "🌄 おはようニコリ！！今日はどんなマイクラライフにするニコリ！？"
+MORNING_LOG_KEEP_DAYS = 7
+
+morning_broadcaster = Broadcaster(
+    bot,
+    morning_log,
+    save_progress=lambda broadcast_id: save_json(MORNING_LOG_FILE, morning_log, key=broadcast_id),
+    claim=lambda broadcast_id, user_id: claim_morning(broadcast_id, user_id),
+)
+
+async def claim_morning(broadcast_id, user_id):
+    # 送る直前に「この人に送る」札をDBにすぐ書くニコリ（1プロセスのときも）。
+    # 再起動したあとは札がある人には送らないので、同じあいさつが二回届かないニコリ
+    store = get_store()
+    return bool(await store.run_in_writer(store.claim_once, [f"morning:{broadcast_id}:{user_id}"]))
+
+def reset_sleep_data():
+    # DBの寝データはリーダーだけがリセットするニコリ
+    for uid in sleep_data:
+        sleep_data[uid] = {}
+    save_json(SLEEP_FILE, sleep_data)
+    print("💤 寝データをリセットしたニコリ！！")
+
+_sleepiness_reset_on = None  # このプロセスの眠気を最後にリセットした日
+
+def reset_sleepiness(today):
+    # 眠気レベルはプロセスごとなので、どのワーカーも自分で朝リセットするニコリ
+    global sleepiness_level, _sleepiness_reset_on
+    if _sleepiness_reset_on == today:
+        return
+    _sleepiness_reset_on = today
+    sleepiness_level = 0
+
+async def prune_morning_log(today):
+    # 古い送信記録は消しておくニコリ
+    for day in list(morning_log):
+        try:
+            age = (today - datetime.fromisoformat(day).date()).days
+        except ValueError:
+            continue
+        if age > MORNING_LOG_KEEP_DAYS:
+            del morning_log[day]
+            save_json(MORNING_LOG_FILE, morning_log, key=day)
+    store = get_store()
+    await store.run_in_writer(store.prune, MORNING_LOG_KEEP_DAYS * 24 * 3600)  # 古い札も消しておくニコリ
+
+@tasks.loop(minutes=1)
+async def morning_message_loop():
+    now = datetime.now()
+    if now.hour != 6:
+        return
+    today = now.date().isoformat()
+    reset_sleepiness(today)
+    if not coordinator.is_leader:
+        return  # 朝のあいさつはリーダーだけが送るニコリ
+    # 6時台なら、今日の分が終わってなければ送る（途中で再起動しても続きから送るニコリ）
+    if morning_broadcaster.is_done(today):
+        return
+    if not morning_broadcaster.has_started(today):
+        reset_sleep_data()
+        await prune_morning_log(now.date())
+    user_ids = user_settings.morning_users()  # 受け取る人だけの索引から出すニコリ
+    await morning_broadcaster.run(today, user_ids, MORNING_TEXT)
+
+# 誕生日お祝いコマンド（名前指定バージョン）
+@bot.tree.command(name="nikorihito_birthday", description="誕生日を全力でお祝いするニコリ！（名前指定できるよ）")
+@timed_command
+async def nikorihito_birthday(interaction: discord.Interaction, name: str):
+    if name in ["ニコリヒト", "nikorihito"]:
+        message = "僕の誕生日を祝ってくれるの！？ありがとうニコリ！！🎂🍲✨\nすっごく嬉しいニコリ！！！ニコリニコリ！！"
+    else:
+        message = (
+            f"{name}の誕生日おめでとうニコリ！！🎉🎂✨\n"
+            "ケーキ🎂とビーフシチュー🍲で盛大にお祝いするニコリ！！\n"
+            "🎵 [バースデーソングを聴いてね！](http://nikorihito.com/wp-content/uploads/2025/03/はっぴいばあすでいつーゆー.mp3)"
+        )
+    await interaction.response.send_message(message)
+
+# 雑談対応と音声読み上げ処理（@mention）
+# メンションは受付係（MentionQueue）に並べて、チャンネルごとにまとめて返事するニコリ
+def describe_attachments(attachments):
+    # ▼▼▼ 添付ファイル対応処理ここからニコリ！ ▼▼▼
+    attachment_urls = []
+    file_notes = []
+    for attachment in attachments:
+        url = attachment.url
+        attachment_urls.append(url)
+
+        if url.lower().endswith(('.gif')):
+            file_notes.append("（GIFアニメっぽいニコリ！動いてるニコリ！）")
+        elif url.lower().endswith(('.jpg', '.jpeg', '.png')):
+            file_notes.append("（画像ファイルっぽいニコリ！）")
+        elif url.lower().endswith(('.mp4', '.mov', '.webm')):
+            file_notes.append("（動画っぽいニコリ！？）")
+        else:
+            file_notes.append("（何かのファイルニコリ！中身は見てのお楽しみニコリ！）")
+    # ▲▲▲ 添付ファイル対応処理ここまでニコリ！ ▲▲▲
+
+    # プロンプトには予算内に収まる分だけ入れるので、ここでは行のリストにしておくニコリ
+    return [f"{url} {note}" for url, note in zip(attachment_urls, file_notes)]
+
+def collect_attachments(message):
+    # 返信先のメッセージに付いてる画像も一緒に見るニコリ（中身はキャッシュから出てくるニコリ）
+    attachments = list(message.attachments)
+    referenced = message.reference.resolved if message.reference else None
+    if isinstance(referenced, discord.Message):
+        attachments += referenced.attachments
+    return attachments
+
+def make_mention_job(message):
+    user_input = re.sub(rf"<@!?{bot.user.id}>", "", message.content).strip()
+    attachments = collect_attachments(message)
+    attachment_lines = describe_attachments(attachments)
+    history_input = user_input
+    if attachment_lines:
+        file_descriptions = "\n".join(attachment_lines)
+        history_input += f"\n[添付ファイルが送られたニコリ！内容はこちらニコリ：\n{file_descriptions}\n]"
+    return {
+        "message": message,
+        "user_id": str(message.author.id),
+        "user_name": message.author.display_name,
+        "language": get_user_settings(message.author.id).language,
+        "user_input": user_input,
+        "attachments": attachments,
+        "attachment_lines": attachment_lines,
+        "history_input": history_input,
+    }
+
+async def reply_to_mentions(channel_id, jobs):
+    # 同じチャンネルで立て続けに来たメンションは1回の生成でまとめて返事するニコリ
+    # （まとめるのは同じ言語の人だけ。履歴は最後の人のものを使って、キャッシュは使わないニコリ）
+    last = jobs[-1]
+    message = last["message"]
+    user_id = last["user_id"]
+    if len(jobs) == 1:
+        user_name = last["user_name"]
+        user_input = last["user_input"]
+    else:
+        user_name = "、".join(dict.fromkeys(job["user_name"] for job in jobs))
+        user_input = "\n".join(f"{job['user_name']}：{job['user_input']}" for job in jobs)
+    attachment_lines = [line for job in jobs for line in job["attachment_lines"]]
+    attachments = [a for job in jobs for a in job["attachments"]]
+
+    # 🔽 初期化（履歴なければ作るニコリ！）
+    for job in jobs:
+        if job["user_id"] not in chat_history:
+            chat_history[job["user_id"]] = UserHistory(job["user_id"], job["user_name"])
+        else:
+            chat_history[job["user_id"]].name = job["user_name"]
+
+    timings = {}  # 段階ごとの時間（最後に1行のJSONログにするニコリ）
+    async with message.channel.typing():  # 考えてる間は「入力中…」を出すニコリ
+        if attachments:
+            with stage("attachments", timings):
+                image_parts = await attachment_fetcher.fetch_many(attachments)
+        else:
+            image_parts = []
+        with stage("generate", timings):
+            reply = await ask_nikorihito(user_id, user_input, user_name, attachment_lines, image_parts,
+                                         allow_cache=len(jobs) == 1)
+    image_path = generate_image_from_text(reply)  # Gemini用に変更ニコリ！
+
+    with stage("history", timings):
+        for job in jobs:
+            chat_history[job["user_id"]].append("user", job["history_input"])
+            chat_history[job["user_id"]].append("ニコリヒト😁", reply)
+            save_json(MEMORY_FILE, chat_history, key=job["user_id"])
+
+    language = last["language"]
+    if VOICE_MODE == "followup":
+        # 文字を先に送って、音声は合成できたらメッセージにくっつけるニコリ
+        with stage("send", timings):
+            sent = await message.channel.send(reply)
+
+        with stage("tts", timings):
+            voice_file = await generate_voice_file(reply, language)
+
+        with stage("upload", timings):
+            if voice_file:
+                try:
+                    await sent.edit(attachments=[voice_file])
+                except discord.HTTPException as e:
+                    print("音声をくっつけられなかったので別で送るニコリ：", e)
+                    voice_file.reset()
+                    await message.channel.send(file=voice_file)
+    else:
+        with stage("tts", timings):
+            voice_file = await generate_voice_file(reply, language)
+
+        with stage("send", timings):
+            if voice_file:
+                await message.channel.send(reply, file=voice_file)
+            else:
+                await message.channel.send(reply)
+
+    log_event("reply", user_id=user_id, channel_id=channel_id, mentions=len(jobs), mode=VOICE_MODE, **timings)
+
+    if image_path and os.path.exists(image_path):  # ← これが画像添付ニコリ！！
+        await message.channel.send(file=discord.File(image_path))
+        os.remove(image_path)
+
+async def react_sweating(message):
+    # 返事できないときは、せめてリアクションだけしておくニコリ
+    try:
+        await message.add_reaction("💦")
+    except discord.HTTPException:
+        pass
+
+async def on_reply_failed(channel_id, jobs):
+    for job in jobs:
+        await react_sweating(job["message"])
+
+mention_queue = MentionQueue(reply_to_mentions, wait_observer=metrics.QUEUE_WAIT_SECONDS.observe,
+                             batch_key=lambda job: job["language"], on_error=on_reply_failed)
+
+# 🔁 この on_message だけ残すニコリ！
+@bot.event
+async def on_message(message):
+    if message.author.bot or not message.content.strip():
+        return
+    if mute_status.is_muted(mute_scope(message.guild, message.author)):
+        return
+
+    if bot.user.mentioned_in(message):
+        with stage("on_message"):
+            job = make_mention_job(message)
+            accepted = not job["history_input"] or mention_queue.submit(message.channel.id, job)
+        if not accepted:
+            # 混みすぎてるときは返事をあきらめて、リアクションだけしておくニコリ
+            print("メンションが多すぎるので断ったニコリ…", mention_queue.snapshot())
+            await react_sweating(message)
+
+    await bot.process_commands(message)
+
+# /settings コマンドで言語や朝メッセージ設定変更できるニコリ
+@bot.tree.command(name="settings", description="設定を変えるニコリ！")
+@timed_command
+async def settings(interaction: discord.Interaction, language: str = None, morning_message: bool = None):
+    fields = {}
+    if language:
+        fields["language"] = language
+    if morning_message is not None:
+        fields["morning_message"] = morning_message
+    record = update_user_settings(interaction.user.id, **fields)
+    await interaction.response.send_message(f"設定を更新したニコリ！！今はこんな感じだニコリ〜\n{record.to_json()}")
+
+# 起動時イベント
+def command_tree_hash():
+    # 登録してるスラッシュコマンドの中身からハッシュを作るニコリ
+    payload = []
+    for command in bot.tree.get_commands():
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:  # 古い discord.py は引数なしニコリ
+            payload.append(command.to_dict())
+    text = json.dumps([bot.user.id, payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+async def sync_commands_if_changed():
+    # コマンドが変わったときだけ sync するニコリ（毎回やると遅いし制限にもかかる）
+    digest = command_tree_hash()
+    if bot_meta.get("command_hash") == digest:
+        print("コマンドは変わってないので sync しないニコリ")
+        return
+    await bot.tree.sync()
+    bot_meta["command_hash"] = digest
+    save_json(META_FILE, bot_meta, key="command_hash")
+    print("コマンドを sync したニコリ！")
+
+def print_startup_report():
+    lines = []
+    previous = STARTUP_STARTED
+    for phase, at in startup_phases:
+        lines.append(f"{phase}={at - previous:.3f}s")
+        previous = at
+    print(f"🚀 起動時間ニコリ：total={previous - STARTUP_STARTED:.3f}s " + " ".join(lines))
+
+_ready_once = False
+
+@bot.event
+async def on_ready():
+    global _ready_once
+    if _ready_once:
+        # 再接続のときはもう準備できてるので何もしないニコリ
+        print(f"{bot.user} が再接続したニコリ〜！")
+        return
+    mark_startup("gateway")
+    # ループを先に動かすニコリ（コマンドの sync が失敗しても、リマインダーと朝のあいさつは止まらない）
+    coordinator.start()  # リーダーになったらリマインダーの予定表が動き出すニコリ
+    if not morning_message_loop.is_running():
+        morning_message_loop.start()
+    mark_startup("loops")
+    if cluster.owns_shard(0):
+        try:
+            await sync_commands_if_changed()  # コマンドの sync はシャード0を持ってるプロセスだけニコリ
+        except discord.HTTPException as e:
+            print("コマンドの sync に失敗したニコリ…次につながったときにやり直すニコリ", e)
+            return
+    mark_startup("command_sync")
+    _ready_once = True  # ここまで来たら準備おわりニコリ
+    print(f"{bot.user} がログインしたニコリ〜！🍲🔥")
+    print_startup_report()
+    # Gemini の読み込みは裏でやっておいて、最初のメンションを待たせないニコリ
+    asyncio.get_running_loop().run_in_executor(None, get_gemini_model)
+
+# ミュート・ミュート解除
+@bot.tree.command(name="mute", description="このサーバーでnikorihitoを黙らせるニコリ")
+@timed_command
+async def mute(interaction: discord.Interaction):
+    # ミュートはこのサーバーだけニコリ（DMならその人とのDMだけ）
+    for scope in mute_status.set_muted(mute_scope(interaction.guild, interaction.user), True):
+        save_json(MUTE_FILE, mute_status, key=scope)
+    await interaction.response.send_message("しばらく静かにするニコリ...😶")
+
+@bot.tree.command(name="mute_off", description="このサーバーでnikorihitoのミュートを解除するニコリ")
+@timed_command
+async def mute_off(interaction: discord.Interaction):
+    for scope in mute_status.set_muted(mute_scope(interaction.guild, interaction.user), False):
+        save_json(MUTE_FILE, mute_status, key=scope)
+    await interaction.response.send_message("いやっほ！しゃべれる、しゃべれるニコリ！！早速ビーフシチュー食べるぞー！！ニコリ！！ふぁー、お肉に味が染みてるーー！！😍😍ニコリ！！")
+
+# 今の状態を見るニコリ（Gemini のペース配分など）
+@bot.tree.command(name="nikorihito_status", description="ニコリヒトの今の調子を見るニコリ")
+@timed_command
+async def nikorihito_status(interaction: discord.Interaction):
+    stats = gemini_limiter.snapshot()
+    stats["loop_lag_sec"] = round(metrics.loop_lag_monitor.last_lag, 3)
+    stats["worker"] = f"{cluster.WORKER_INDEX + 1}/{cluster.WORKERS}"
+    stats["leader"] = coordinator.is_leader
+    stats["shards"] = ",".join(str(s) for s in bot.shards) if cluster.SHARDED else "-"
+    lines = [f"- {key}: {value}" for key, value in stats.items()]
+    lines += [f"- cache_{key}: {value}" for key, value in response_cache.stats().items()]
+    lines += [f"- queue_{key}: {value}" for key, value in mention_queue.snapshot().items()]
+    await interaction.response.send_message(
+        f"今の調子はこんな感じニコリ！（眠気レベル {sleepiness_level}）\n" + "\n".join(lines),
+        ephemeral=True,
+    )
+
+# 管理者用：数秒だけプロファイルを取って、重い関数と collapsed スタックを返すニコリ
+def is_admin(interaction):
+    perms = getattr(interaction.user, "guild_permissions", None)
+    return interaction.user.id in ADMIN_IDS or bool(perms and perms.administrator)
+
+@bot.tree.command(name="nikorihito_profile", description="（管理者用）ニコリヒトのどこが重いか数秒だけ調べるニコリ")
+@app_commands.default_permissions(administrator=True)
+@timed_command
+async def nikorihito_profile(interaction: discord.Interaction, seconds: int = 10):
+    if not is_admin(interaction):
+        await interaction.response.send_message("これは管理者だけが使えるニコリ！", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        # プロファイラーは別スレッドで動かして、イベントループはそのまま回すニコリ
+        await asyncio.get_running_loop().run_in_executor(None, profiler.run, max(1, seconds))
+    except RuntimeError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+    top = profiler.top_functions(10)
+    log_event("profile", seconds=seconds, samples=profiler.samples,
+              top=[{"function": name, "samples": count} for name, count in top])
+    lines = [f"{count:>5} {name}" for name, count in top]
+    await interaction.followup.send(
+        f"{seconds}秒で {profiler.samples} 回のぞいたニコリ！重いのはこのへん：\n```\n" + "\n".join(lines) + "\n```",
+        file=discord.File(io.BytesIO(profiler.collapsed().encode("utf-8")), filename="nikorihito_profile.collapsed.txt"),
+        ephemeral=True,
+    )
+
+# ✅ Render向けのヘルスチェックとメトリクス（ボットと同じイベントループで動くニコリ）
+metrics.registry.gauge("nikorihito_queue_depth", "Mentions waiting in the ingress queue",
+                       lambda: mention_queue.pending)
+metrics.registry.gauge("nikorihito_gemini_rate_per_second", "Current adaptive Gemini request rate",
+                       lambda: gemini_limiter.rate)
+metrics.registry.gauge("nikorihito_gemini_rate_limited_total", "429 responses seen from Gemini",
+                       lambda: gemini_limiter.rate_limited)
+metrics.registry.gauge("nikorihito_response_cache_hit_ratio", "Response cache hit ratio",
+                       lambda: response_cache.stats()["hit_rate"])
+metrics.registry.gauge("nikorihito_reminders_scheduled", "Reminders registered with the scheduler",
+                       lambda: len(reminder_loop))
+metrics.registry.gauge("nikorihito_is_leader", "1 if this worker runs reminders and the morning broadcast",
+                       lambda: int(coordinator.is_leader))
+
+async def setup_hook():
+    # ゲートウェイにつなぐ前にHTTPサーバーを立てて、Render のヘルスチェックにすぐ答えるニコリ
+    get_store().flush_listeners.append(metrics.FLUSH_SECONDS.observe)
+    await metrics.start_web_server(bot, int(os.environ.get("PORT", 10000)))
+    mark_startup("web")
+
+bot.setup_hook = setup_hook
+
+_close_bot = bot.close
+
+async def close_bot():
+    # 止まるときは、添付ファイルの取得で使ってたHTTPセッションも閉じるニコリ
+    try:
+        await _close_bot()
+    finally:
+        await attachment_fetcher.close()
+
+bot.close = close_bot
+
+mark_startup("setup")
+
+# ✅ 起動！
+if __name__ == "__main__":
+    bot.run(DISCORD_BOT_TOKEN)
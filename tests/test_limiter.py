@@ -0,0 +1,39 @@
+# Gemini のペース配分のテストニコリ（python -m pytest tests）
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nikorihito_limiter import AdaptiveRateLimiter  # noqa: E402
+
+
+def test_waiter_gives_up_when_a_429_pushes_past_its_budget():
+    limiter = AdaptiveRateLimiter(rate=10.0, burst=1.0)
+    limiter.tokens = 0.0  # 次のトークンまで 0.1 秒
+
+    async def scenario():
+        waiter = asyncio.create_task(limiter.acquire(budget=0.3))
+        await asyncio.sleep(0.01)
+        limiter.on_rate_limited(retry_after=5.0)  # 並んでる間に 429 が来たニコリ
+        started = time.monotonic()
+        granted = await waiter
+        return granted, time.monotonic() - started
+
+    granted, waited = asyncio.run(scenario())
+    assert granted is False
+    assert waited < 1.0
+    assert limiter.rejected == 1
+    assert limiter.snapshot()["queue_depth"] == 0
+
+
+def test_waiter_within_budget_is_granted():
+    limiter = AdaptiveRateLimiter(rate=10.0, burst=1.0)
+    limiter.tokens = 0.0
+
+    async def scenario():
+        return await limiter.acquire(budget=1.0)
+
+    assert asyncio.run(scenario()) is True
+    assert limiter.granted == 1
@@ -0,0 +1,120 @@
+# リマインダーの予定表のテストニコリ（python -m pytest tests）
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nikorihito_scheduler import ReminderScheduler  # noqa: E402
+from nikorihito_state import Reminder, ReminderTable  # noqa: E402
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(reminders, state, clock, sent):
+    async def send(user_id, reminder):
+        sent.append((user_id, reminder.content))
+
+    return ReminderScheduler(reminders, send=send, save=lambda user_id: None,
+                             state=state, save_state=lambda: None, clock=clock)
+
+
+def test_reminder_added_after_its_time_does_not_fire_on_restart():
+    reminders = ReminderTable(lambda: {})
+    state = {"last_run": datetime(2026, 1, 1, 7, 30).isoformat()}
+    clock = Clock(datetime(2026, 1, 1, 9, 0))
+    sent = []
+
+    async def scenario():
+        scheduler = make_scheduler(reminders, state, clock, sent)
+        scheduler.rebuild()
+        reminder = Reminder.parse("08:00", "お水を飲む")
+        reminders.add("1", reminder)
+        scheduler.add("1", reminder)
+        await scheduler.fire_due()  # add() で起きたループの1回分
+
+        # 10:00 に再起動
+        clock.now = datetime(2026, 1, 1, 10, 0)
+        restarted = make_scheduler(reminders, state, clock, sent)
+        restarted.rebuild()
+        await restarted.fire_due()
+        return restarted
+
+    restarted = asyncio.run(scenario())
+    assert sent == []
+    assert restarted._heap[0][0] == datetime(2026, 1, 2, 8, 0)
+
+
+def test_reminder_missed_while_down_is_caught_up():
+    reminders = ReminderTable(lambda: {"1": [{"time": "08:00", "content": "お水を飲む", "repeat": False}]})
+    state = {"last_run": datetime(2026, 1, 1, 7, 30).isoformat()}
+    clock = Clock(datetime(2026, 1, 1, 10, 0))
+    sent = []
+
+    async def scenario():
+        scheduler = make_scheduler(reminders, state, clock, sent)
+        scheduler.rebuild()
+        await scheduler.fire_due()
+
+    asyncio.run(scenario())
+    assert sent == [("1", "お水を飲む")]
+    assert reminders.count == 0
+    assert state["last_run"] == datetime(2026, 1, 1, 10, 0).isoformat()
+
+
+def test_identical_reminders_are_claimed_separately():
+    reminders = ReminderTable(lambda: {})
+    state = {"last_run": datetime(2026, 1, 1, 7, 59).isoformat()}
+    clock = Clock(datetime(2026, 1, 1, 8, 0))
+    sent = []
+    claimed = set()
+
+    async def claim(user_id, reminder, fire_at):
+        key = f"reminder:{user_id}:{reminder.id}:{fire_at.isoformat()}"
+        if key in claimed:
+            return False
+        claimed.add(key)
+        return True
+
+    async def send(user_id, reminder):
+        sent.append((user_id, reminder.content))
+
+    async def scenario():
+        reminders.add("1", Reminder.parse("08:00", "お水を飲む"))
+        reminders.add("1", Reminder.parse("08:00", "お水を飲む"))
+        scheduler = ReminderScheduler(reminders, send=send, save=lambda user_id: None, state=state,
+                                      save_state=lambda: None, clock=clock, claim=claim)
+        scheduler.rebuild()
+        await scheduler.fire_due()
+
+    asyncio.run(scenario())
+    assert sent == [("1", "お水を飲む"), ("1", "お水を飲む")]
+    assert reminders.count == 0
+
+
+def test_one_shot_is_removed_even_if_reloaded_while_firing():
+    raw = {"1": [{"time": "08:00", "content": "お水を飲む", "repeat": False, "id": "a1"}]}
+    reminders = ReminderTable(lambda: raw)
+    state = {"last_run": datetime(2026, 1, 1, 7, 59).isoformat()}
+    clock = Clock(datetime(2026, 1, 1, 8, 0))
+
+    async def send(user_id, reminder):
+        # 送ってる間に、ほかのプロセスの変更を取り込んで別のオブジェクトになったニコリ
+        reminders[user_id] = reminders.decode(user_id, raw[user_id])
+
+    async def scenario():
+        scheduler = ReminderScheduler(reminders, send=send, save=lambda user_id: None, state=state,
+                                      save_state=lambda: None, clock=clock)
+        scheduler.rebuild()
+        await scheduler.fire_due()
+
+    asyncio.run(scenario())
+    assert "1" not in reminders
+    assert reminders.count == 0
@@ -0,0 +1,62 @@
+# SQLiteストアのまとめ書きのテストニコリ（python -m pytest tests）
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nikorihito_store  # noqa: E402
+from nikorihito_store import JsonStore  # noqa: E402
+
+
+def test_locked_write_is_restored_and_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(nikorihito_store, "BUSY_TIMEOUT", 0.05)
+    db_path = str(tmp_path / "test.db")
+    store = JsonStore(db_path, flush_interval=0.05, shared=True, owner="a")
+    other = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+
+    async def scenario():
+        data = {"x": 1}
+        other.execute("BEGIN IMMEDIATE")  # ほかのプロセスが書いてる途中ニコリ
+        store.save("f", data, key="x")
+        await asyncio.sleep(0.3)
+        locked = (store.is_dirty("f", "x"), store.load_key("f", "x"), store.flush_count)
+        other.execute("COMMIT")
+        await asyncio.sleep(0.3)
+        return locked
+
+    locked = asyncio.run(scenario())
+    assert locked == (True, (False, None), 0)
+    assert not store.is_dirty("f", "x")
+    assert store.load_key("f", "x") == (True, 1)
+    assert store.flush_count == 1
+    other.close()
+    store.close()
+
+
+def test_flush_waits_for_in_flight_write(tmp_path):
+    store = JsonStore(str(tmp_path / "test.db"), flush_interval=10, shared=False)
+    release = threading.Event()
+    write_rows = store._write_rows
+
+    def slow_write(rows):
+        release.wait(5)
+        write_rows(rows)
+
+    async def scenario():
+        data = {"x": 1}
+        store._write_rows = slow_write
+        store.save("f", data, key="x")
+        store._start_flush()  # タイマーの代わり：x=1 を書き込み用スレッドで書きはじめるニコリ
+        store._write_rows = write_rows
+        data["x"] = 2
+        store.save("f", data, key="x")
+        threading.Timer(0.1, release.set).start()
+        store.flush()  # 先に x=1 が書き終わるのを待ってから x=2 を書くニコリ
+        await asyncio.sleep(0.3)
+
+    asyncio.run(scenario())
+    assert store.load_key("f", "x") == (True, 2)
+    store.close()